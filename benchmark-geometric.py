@@ -0,0 +1,202 @@
+#!/usr/bin/python
+"""
+Benchmark the stages of the geometric parser on synthetic rolls.
+
+For each scale (number of pages), a synthetic roll is generated (see
+synthetic.py), and the following are timed:
+
+  parse           : parsing the XML document
+  dataRegions     : computeDataRegions - loading vector files, finding boxes
+  findRects       : findRects alone, on the already loaded shapes
+  voterInfo       : getVoterInfo - assigning tokens to boxes, and extraction
+  extract         : extractVoterInfo alone, on the already assigned tokens
+  writeCsv        : writing the records to CSV
+  total           : the whole file, as parse-geometric.py does it
+
+Each scale runs in its own process, so that the peak memory reported
+is for that scale alone.
+
+e.g.
+  ./benchmark-geometric.py --scales 1,10,100
+  ./benchmark-geometric.py --json bench.json
+"""
+import xml.etree.ElementTree as ET
+import multiprocessing
+import argparse
+import tempfile
+import shutil
+import codecs
+import json
+import time
+import sys
+import os
+
+try:
+	import resource
+except ImportError:
+	# Not available on Windows
+	resource = None
+
+import synthetic
+from geometric import *
+
+stages = ['parse', 'dataRegions', 'findRects', 'voterInfo', 'extract', 'writeCsv', 'total']
+
+class Options(object):
+	# Options for extractFile, as parse-geometric.py would give them
+	stream = False
+	debug = False
+	epic = None
+	page = None
+	source_pdf = None
+	layout_template = False
+	cache = None
+	write_index = False
+	page_jobs = 1
+
+def peakMemory():
+	# Peak resident memory of this process, in MB
+	if resource is None:
+		return None
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		return maxrss/(1024.0*1024.0)
+	return maxrss/1024.0
+
+def loadGroups(filename, thisPage):
+	# Load the GROUPs of a page's vector file, as computeDataRegions does
+	return loadShapes(shapePath(filename, thisPage))
+
+def best(func, repeat):
+	# Best wall time of 'repeat' runs of func, and its result
+	bestTime = None
+	for i in range(repeat):
+		start = time.time()
+		result = func()
+		elapsed = time.time() - start
+		if (bestTime is None) or (elapsed < bestTime):
+			bestTime = elapsed
+	return (bestTime, result)
+
+def runScale(pages, settings, workDir, repeat):
+	filename = os.path.join(workDir, 'SYN%04d.xml'%(pages))
+	s = dict(settings)
+	s['pages'] = pages
+	synthetic.generate(filename, s)
+
+	loadConfig()
+	cfg = getConfig(filename)
+	minW, maxW = cfg['infoBoxWidthRange']
+	minH, maxH = cfg['infoBoxHeightRange']
+	noDebug = makeDebugMatch(False, None, None)
+	times = {}
+
+	(times['parse'], pageList) = best(lambda: ET.parse(filename).getroot().findall('PAGE'), repeat)
+
+	(times['dataRegions'], rectList) = best(lambda: map(lambda p: computeDataRegions(filename, cfg, p), pageList), repeat)
+
+	groupList = map(lambda p: loadGroups(filename, p), pageList)
+	(times['findRects'], dummy) = best(lambda: map(lambda g: findRects(g, minW, maxW, minH, maxH), groupList), repeat)
+
+	def voterInfo():
+		records = []
+		for (pageNo, (thisPage, rects)) in enumerate(zip(pageList, rectList)):
+			records.extend(getVoterInfo(cfg, PageTokens(thisPage), rects, pageNo+1, noDebug))
+		return records
+	(times['voterInfo'], records) = best(voterInfo, repeat)
+
+	# Tokens for each box, assigned up front
+	boxes = []
+	for (pageNo, (thisPage, rects)) in enumerate(zip(pageList, rectList)):
+		tokens = PageTokens(thisPage)
+		index = buildTokenIndex(tokens)
+		for r in rects:
+			boxes.append((r, tokens, tokensInRect(index, r), pageNo+1))
+	def extract():
+		return map(lambda (r, tokens, toks, pageNo): extractVoterInfo(cfg, r, tokens, toks, pageNo, noDebug), boxes)
+	(times['extract'], dummy) = best(extract, repeat)
+
+	csvName = os.path.join(workDir, 'out.csv')
+	def writeCsv():
+		f = codecs.open(csvName, 'w', 'utf-8')
+		writeHeader(f, sep)
+		writeRecords(f, records, sep)
+		f.close()
+	(times['writeCsv'], dummy) = best(writeCsv, repeat)
+
+	def total():
+		f = codecs.open(csvName, 'w', 'utf-8')
+		writeHeader(f, sep)
+		for vInfo in extractFile(filename, Options()):
+			writeRecords(f, vInfo, sep)
+		f.close()
+	(times['total'], dummy) = best(total, repeat)
+
+	return {
+		'pages' : pages,
+		'records' : len(records),
+		'seconds' : times,
+		'peakMemoryMB' : peakMemory(),
+	}
+
+def runScaleWorker(queue, pages, settings, workDir, repeat):
+	try:
+		queue.put(runScale(pages, settings, workDir, repeat))
+	except Exception as e:
+		queue.put({'pages' : pages, 'error' : repr(e)})
+
+def report(results):
+	print '%6s %8s  %s  %9s'%('pages', 'records', ' '.join(map(lambda s: '%11s'%(s), stages)), 'peak MB')
+	for r in results:
+		if 'error' in r:
+			print '%6d  failed: %s'%(r['pages'], r['error'])
+			continue
+		rates = []
+		for stage in stages:
+			t = r['seconds'][stage]
+			if t > 0:
+				rates.append('%11.0f'%(r['records']/t))
+			else:
+				rates.append('%11s'%('-'))
+		mem = '-'
+		if r['peakMemoryMB'] is not None:
+			mem = '%.1f'%(r['peakMemoryMB'])
+		print '%6d %8d  %s  %9s'%(r['pages'], r['records'], ' '.join(rates), mem)
+	print '(records/sec for each stage)'
+
+# The guard keeps worker processes on Windows from running this
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--scales", type=str, default='1,10,50', help="Comma separated list of page counts to benchmark, defaults to 1,10,50")
+	parser.add_argument("--repeat", type=int, default=3, help="Runs of each stage; the best time is taken. Defaults to 3")
+	parser.add_argument("--line-ratio", type=float, default=synthetic.defaults['lineRatio'], help="Fraction of boxes drawn as separate lines")
+	parser.add_argument("--noise", type=int, default=synthetic.defaults['noise'], help="Decorative shapes per page")
+	parser.add_argument("--json", type=str, help="Also write the results to this JSON file")
+	parser.add_argument("--keep", type=str, help="Generate the rolls in this directory, and keep them. By default a temporary directory is used.")
+	args = parser.parse_args()
+
+	settings = {'lineRatio' : args.line_ratio, 'noise' : args.noise}
+	if args.keep:
+		workDir = args.keep
+		if not os.path.isdir(workDir):
+			os.makedirs(workDir)
+	else:
+		workDir = tempfile.mkdtemp(prefix='bench-geometric-')
+
+	results = []
+	try:
+		for pages in map(int, args.scales.split(',')):
+			queue = multiprocessing.Queue()
+			p = multiprocessing.Process(target=runScaleWorker, args=(queue, pages, settings, workDir, args.repeat))
+			p.start()
+			results.append(queue.get())
+			p.join()
+	finally:
+		if not args.keep:
+			shutil.rmtree(workDir)
+
+	report(results)
+	if args.json:
+		f = open(args.json, 'w')
+		json.dump(results, f, indent=2)
+		f.close()
@@ -0,0 +1,189 @@
+"""
+Block compressed files of voter records.
+
+parse-geometric.py --format csvz writes the same lines as the CSV
+output, but cut into blocks of about blockSize bytes, each compressed
+with zlib on its own. An index at the end of the file gives the offset
+of every block, the blocks that hold each page of each source file,
+and the block of every EPIC number. A reader seeks to the blocks it
+needs, and decompresses only those.
+
+Layout of the file:
+
+  magic      'VLBZ1\\n'
+  blocks     zlib streams, one after the other
+  index      zlib compressed marshal of a dict:
+               fields     : names of the fields in each line
+               sep        : field separator
+               blocks     : (offset, length) of each block
+               pages      : {(file, page) : (first block, last block)}
+               epics      : EPIC numbers, sorted
+               epicBlocks : block of each EPIC number in epics
+  trailer    offset of the index (8 bytes, big endian), then 'VLBZ'
+
+The index is written when the file is closed. A file that was not
+closed (e.g. the writer crashed) has no trailer, and can't be read.
+"""
+import bisect
+import marshal
+import struct
+import zlib
+import os
+
+magic = 'VLBZ1\n'
+trailerMagic = 'VLBZ'
+trailerFormat = '>Q4s'
+trailerSize = struct.calcsize(trailerFormat)
+
+# Uncompressed size of a block, in characters. Larger blocks compress
+# better; smaller ones are quicker to read for a lookup.
+blockSize = 65536
+
+def epicKey(epic):
+	if isinstance(epic, unicode):
+		return epic.encode('utf-8')
+	return epic
+
+def splitLine(line, sep, count):
+	values = line.split(sep)
+	if len(values) > count:
+		# The separator appeared in the last field (residence)
+		values = values[:count-1] + [sep.join(values[count-1:])]
+	return tuple(values)
+
+class BlockWriter(object):
+	def __init__(self, path, fields, sep, blockSize=blockSize):
+		self.f = open(path, 'wb')
+		self.f.write(magic)
+		self.offset = len(magic)
+		self.fields = fields
+		self.sep = sep
+		self.blockSize = blockSize
+		self.lines = []
+		self.size = 0
+		self.blocks = []
+		self.pages = {}
+		self.epics = []
+
+	def add(self, line, page, epic):
+		# Adds the line of a record, from the given page (a tuple of
+		# source file and page number) and with the given EPIC number
+		block = len(self.blocks)
+		span = self.pages.get(page)
+		if span is None:
+			self.pages[page] = (block, block)
+		elif span[1] != block:
+			self.pages[page] = (span[0], block)
+		if epic:
+			self.epics.append((epicKey(epic), block))
+		self.lines.append(line)
+		self.size = self.size + len(line) + 1
+		if self.size >= self.blockSize:
+			self.flush()
+
+	def flush(self):
+		if not self.lines:
+			return
+		self.lines.append(u'')
+		data = zlib.compress(u'\n'.join(self.lines).encode('utf-8'))
+		self.f.write(data)
+		self.blocks.append((self.offset, len(data)))
+		self.offset = self.offset + len(data)
+		self.lines = []
+		self.size = 0
+
+	def close(self):
+		self.flush()
+		self.epics.sort()
+		index = {
+			'fields' : list(self.fields),
+			'sep' : self.sep,
+			'blocks' : self.blocks,
+			'pages' : self.pages,
+			'epics' : map(lambda e: e[0], self.epics),
+			'epicBlocks' : map(lambda e: e[1], self.epics),
+		}
+		self.f.write(zlib.compress(marshal.dumps(index)))
+		self.f.write(struct.pack(trailerFormat, self.offset, trailerMagic))
+		self.f.close()
+
+class BlockReader(object):
+	def __init__(self, path):
+		self.f = open(path, 'rb')
+		if self.f.read(len(magic)) != magic:
+			self.f.close()
+			raise IOError('%s is not a block compressed file'%(path))
+		self.f.seek(-trailerSize, os.SEEK_END)
+		(indexOffset, tag) = struct.unpack(trailerFormat, self.f.read(trailerSize))
+		if tag != trailerMagic:
+			self.f.close()
+			raise IOError('%s is incomplete (no index)'%(path))
+		end = self.f.tell() - trailerSize
+		self.f.seek(indexOffset)
+		index = marshal.loads(zlib.decompress(self.f.read(end - indexOffset)))
+		self.fields = index['fields']
+		self.sep = index['sep']
+		self.blocks = index['blocks']
+		self.pages = index['pages']
+		self.epics = index['epics']
+		self.epicBlocks = index['epicBlocks']
+		self.fieldPos = dict(map(lambda i: (self.fields[i], i), range(len(self.fields))))
+		# The last block read, as lookups often hit the same block
+		self.lastBlock = (None, None)
+
+	def __len__(self):
+		return len(self.blocks)
+
+	def readBlock(self, i):
+		# Returns the records in block i, as tuples in the order of
+		# self.fields
+		if self.lastBlock[0] == i:
+			return self.lastBlock[1]
+		(offset, length) = self.blocks[i]
+		self.f.seek(offset)
+		text = zlib.decompress(self.f.read(length)).decode('utf-8')
+		count = len(self.fields)
+		records = map(lambda line: splitLine(line, self.sep, count), text.split(u'\n')[:-1])
+		self.lastBlock = (i, records)
+		return records
+
+	def records(self):
+		for i in range(len(self.blocks)):
+			for rec in self.readBlock(i):
+				yield rec
+
+	def page(self, filename, pageNo):
+		# Records from the given page of the given source file (name
+		# without extension)
+		span = self.pages.get((filename, pageNo))
+		if span is None:
+			return []
+		pagePos = self.fieldPos['page']
+		filePos = self.fieldPos.get('file')
+		found = []
+		for i in range(span[0], span[1]+1):
+			for rec in self.readBlock(i):
+				if rec[pagePos] != '%d'%(pageNo):
+					continue
+				if filePos is not None and rec[filePos] != filename:
+					continue
+				found.append(rec)
+		return found
+
+	def epic(self, epic):
+		# Records with the given EPIC number
+		key = epicKey(epic)
+		blocks = []
+		i = bisect.bisect_left(self.epics, key)
+		while i < len(self.epics) and self.epics[i] == key:
+			if self.epicBlocks[i] not in blocks:
+				blocks.append(self.epicBlocks[i])
+			i = i + 1
+		epicPos = self.fieldPos['epic']
+		found = []
+		for block in blocks:
+			found.extend(filter(lambda rec: rec[epicPos] == epic, self.readBlock(block)))
+		return found
+
+	def close(self):
+		self.f.close()
@@ -0,0 +1,177 @@
+"""
+Persistent cache of the records extracted from an XML file.
+
+Entries are keyed by a hash of everything that goes into the result:
+the XML file, the vector files it includes from the _data directory,
+the effective config for the file, and the parser source itself. If
+none of these have changed, the records are taken from the cache, and
+the file is not parsed at all.
+
+Each entry is a file in the cache directory, named <name>-<key>.pkl,
+where <name> is the XML file name without extension. Entries are
+evicted by age, and by total size (least recently used first).
+
+Page layout templates (see geometric.py) are kept in the same
+directory, one per AC, named layout-<ac>.pkl. They are evicted along
+with the records.
+"""
+import cPickle
+import hashlib
+import glob
+import time
+import re
+import os
+
+# Read files in chunks of this size when hashing
+chunkSize = 1024*1024
+
+reInclude = re.compile('<[^>]*include[^>]*href="([^"]+)"')
+
+def fileDigest(path):
+	# Hex digest of the content of a file, or None if the file
+	# can't be read.
+	h = hashlib.sha1()
+	try:
+		f = open(path, 'rb')
+	except IOError:
+		return None
+	try:
+		while True:
+			data = f.read(chunkSize)
+			if not data:
+				break
+			h.update(data)
+	finally:
+		f.close()
+	return h.hexdigest()
+
+def scanInput(filename):
+	# Hashes the XML file, and collects the hrefs of the files it
+	# includes, in one pass. Returns (digest, hrefs).
+	h = hashlib.sha1()
+	hrefs = []
+	f = open(filename, 'rb')
+	try:
+		for line in f:
+			h.update(line)
+			if 'include' in line:
+				hrefs.extend(reInclude.findall(line))
+	finally:
+		f.close()
+	return (h.hexdigest(), hrefs)
+
+def cacheKey(digests, cfg):
+	# Combine the digests of all input files, and the effective
+	# config, into one key.
+	h = hashlib.sha1()
+	for d in digests:
+		h.update('%s\n'%(d))
+	h.update(repr(sorted(cfg.items())))
+	return h.hexdigest()
+
+def entryName(filename):
+	return os.path.basename(filename).replace('.xml','')
+
+def entryPath(cacheDir, filename, key):
+	return os.path.join(cacheDir, '%s-%s.pkl'%(entryName(filename), key))
+
+def load(cacheDir, filename, key):
+	# Returns the cached rows for this key, or None if there are
+	# none.
+	path = entryPath(cacheDir, filename, key)
+	try:
+		f = open(path, 'rb')
+	except IOError:
+		return None
+	try:
+		rows = cPickle.load(f)
+	except Exception:
+		# Damaged entry - treat it as a miss
+		return None
+	finally:
+		f.close()
+	# Mark the entry as recently used
+	os.utime(path, None)
+	return rows
+
+def writeEntry(cacheDir, path, obj):
+	if not os.path.isdir(cacheDir):
+		os.makedirs(cacheDir)
+	# Write to a temporary file first, so that readers never see
+	# a partial entry
+	tmpPath = '%s.%d.tmp'%(path, os.getpid())
+	f = open(tmpPath, 'wb')
+	try:
+		cPickle.dump(obj, f, 2)
+	finally:
+		f.close()
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(tmpPath, path)
+
+def store(cacheDir, filename, key, rows):
+	writeEntry(cacheDir, entryPath(cacheDir, filename, key), rows)
+
+def layoutPath(cacheDir, ac):
+	return os.path.join(cacheDir, 'layout-%s.pkl'%(ac))
+
+def loadLayout(cacheDir, ac):
+	# Returns the saved layout for the AC, or None
+	path = layoutPath(cacheDir, ac)
+	try:
+		f = open(path, 'rb')
+	except IOError:
+		return None
+	try:
+		layout = cPickle.load(f)
+	except Exception:
+		return None
+	finally:
+		f.close()
+	os.utime(path, None)
+	return layout
+
+def storeLayout(cacheDir, ac, layout):
+	writeEntry(cacheDir, layoutPath(cacheDir, ac), layout)
+
+def invalidate(cacheDir, filename):
+	# Drop all entries for the file, whatever their key. Returns
+	# the number of entries removed.
+	if not os.path.isdir(cacheDir):
+		return 0
+	reEntry = re.compile('^%s-[0-9a-f]{40}\\.pkl$'%(re.escape(entryName(filename))))
+	count = 0
+	for name in os.listdir(cacheDir):
+		if reEntry.match(name):
+			os.remove(os.path.join(cacheDir, name))
+			count = count + 1
+	return count
+
+def evict(cacheDir, maxSize, maxAge):
+	# Remove entries not used for more than maxAge seconds, and then
+	# the least recently used entries till the total size is no
+	# more than maxSize bytes. Returns the number of entries removed.
+	if not os.path.isdir(cacheDir):
+		return 0
+	now = time.time()
+	entries = []
+	for path in glob.glob(os.path.join(cacheDir, '*.pkl')):
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		entries.append((st.st_mtime, st.st_size, path))
+	entries.sort()
+
+	removed = 0
+	total = sum(map(lambda e: e[1], entries))
+	for (mtime, size, path) in entries:
+		if (now - mtime) <= maxAge and total <= maxSize:
+			continue
+		try:
+			os.remove(path)
+		except OSError:
+			continue
+		total = total - size
+		removed = removed + 1
+	return removed
@@ -11,6 +11,9 @@
 # I got some of this info from 
 # http://j-b.livejournal.com/339214.html
 #
+# This is not needed with "extract-voter-info.py --inflate", which
+# decompresses the streams itself (see pdfinflate.py)
+#
 mkdir converted
 for f in ceo-files/AC*.pdf; 
 do 
@@ -0,0 +1,169 @@
+"""
+Duplicate records in the output of parse-geometric.py, across files,
+booths and constituencies.
+
+Records are grouped by two blocking keys:
+
+  - the EPIC number. Records that share one are duplicates: 'exact' if
+    their name, relative's name, age and sex are the same (ignoring
+    case, spaces and punctuation), 'near' otherwise.
+  - the name, relative's name and age, ignoring case, spaces and
+    punctuation. Records that share these but have different EPIC
+    numbers may be one voter enrolled twice: 'exact' if their sex and
+    residence are the same too, 'near' otherwise.
+
+Grouping is done by sorting (key, record) pairs, so that the records of
+a group come together. Up to maxRecords pairs are sorted in memory.
+Beyond that, they are sorted in runs of maxRecords that are written to
+disk, and the runs are merged; so memory use does not grow with the
+number of records.
+
+Output is a line for each group, followed by its records:
+
+  epic exact REJ0000001 (2 records)
+    <record>
+    <record>
+  name near ramesh kumar / lakshmi / 40 (3 records)
+    ...
+
+with records in the field order of voterdb.fields, separated by '|'.
+"""
+import itertools
+import tempfile
+import operator
+import marshal
+import shutil
+import heapq
+import os
+
+import voterdb
+from geometric import sep
+from voterindex import normalize, reNonAlnum
+from rolldiff import readSpilled
+
+fields = voterdb.fields
+fieldPos = dict(map(lambda i: (fields[i], i), range(len(fields))))
+
+# Number of runs merged at once. If there are more, they are merged
+# into fewer, longer runs first.
+fanIn = 64
+
+def compact(text):
+	# Ignores case, punctuation and how the text is split into words
+	return reNonAlnum.sub('', text.lower())
+
+def blockKeys(rec):
+	keys = []
+	epic = rec[fieldPos['epic']]
+	if epic:
+		keys.append(('E', epic))
+	name = compact(rec[fieldPos['name']])
+	age = rec[fieldPos['age']]
+	if name and age:
+		keys.append(('N', name, compact(rec[fieldPos['relative']]), age))
+	return keys
+
+def identity(rec, names):
+	return tuple(map(lambda f: compact(rec[fieldPos[f]]), names))
+
+#
+# External sort
+#
+
+def writeRun(pairs, tmpDir):
+	# Writes sorted pairs to a run file, and returns its path
+	(fd, path) = tempfile.mkstemp(dir=tmpDir)
+	f = os.fdopen(fd, 'wb')
+	try:
+		for pair in pairs:
+			marshal.dump(pair, f)
+	finally:
+		f.close()
+	return path
+
+def mergeRuns(runs, tmpDir):
+	while len(runs) > fanIn:
+		merged = []
+		for i in range(0, len(runs), fanIn):
+			group = runs[i:i+fanIn]
+			merged.append(writeRun(heapq.merge(*map(readSpilled, group)), tmpDir))
+			for path in group:
+				os.remove(path)
+		runs = merged
+	return heapq.merge(*map(readSpilled, runs))
+
+def sortedPairs(records, maxRecords, tmpDir):
+	# Yields (key, record) for every blocking key of every record, in
+	# key order
+	chunk = []
+	runs = []
+	for rec in records:
+		for key in blockKeys(rec):
+			chunk.append((key, rec))
+		if len(chunk) >= maxRecords:
+			chunk.sort()
+			runs.append(writeRun(chunk, tmpDir))
+			chunk = []
+	chunk.sort()
+	if not runs:
+		return iter(chunk)
+	if chunk:
+		runs.append(writeRun(chunk, tmpDir))
+	return mergeRuns(runs, tmpDir)
+
+#
+# Groups
+#
+
+class DuplicateWriter(object):
+	# Writes out the groups of duplicates, and counts them
+	def __init__(self, f):
+		self.f = f
+		self.counts = {}
+
+	def write(self, block, match, label, recs):
+		self.counts[(block, match)] = self.counts.get((block, match), 0) + 1
+		self.f.write(u'%s %s %s (%d records)\n'%(block, match, label, len(recs)))
+		for rec in recs:
+			self.f.write(u'  %s\n'%(sep.join(rec)))
+
+	def epicGroup(self, key, recs):
+		ids = set(map(lambda rec: identity(rec, ['name', 'relative', 'age', 'sex']), recs))
+		self.write('epic', 'exact' if len(ids) == 1 else 'near', key[1], recs)
+
+	def nameGroup(self, key, recs):
+		# Records with the same EPIC number are reported as an EPIC
+		# group already. Records without one are all counted.
+		epics = set()
+		others = 0
+		for rec in recs:
+			epic = rec[fieldPos['epic']]
+			if epic:
+				epics.add(epic)
+			else:
+				others = others + 1
+		if len(epics) + others < 2:
+			return
+		ids = set(map(lambda rec: identity(rec, ['sex', 'residence']), recs))
+		rec = recs[0]
+		label = u' / '.join(map(lambda f: normalize(rec[fieldPos[f]]), ['name', 'relative', 'age']))
+		self.write('name', 'exact' if len(ids) == 1 else 'near', label, recs)
+
+def findDuplicates(records, f, maxRecords=1000000, tmpDir=None):
+	# Write the groups of duplicates among records (tuples in the order
+	# of voterdb.fields) to f. Returns the DuplicateWriter, with the
+	# counts of groups.
+	writer = DuplicateWriter(f)
+	runDir = tempfile.mkdtemp(prefix='dedupe-', dir=tmpDir)
+	try:
+		for (key, group) in itertools.groupby(sortedPairs(records, maxRecords, runDir), operator.itemgetter(0)):
+			recs = map(operator.itemgetter(1), group)
+			if len(recs) < 2:
+				continue
+			if key[0] == 'E':
+				writer.epicGroup(key, recs)
+			else:
+				writer.nameGroup(key, recs)
+	finally:
+		shutil.rmtree(runDir)
+	return writer
@@ -0,0 +1,41 @@
+#!/usr/bin/python
+"""
+Compare two revisions of a roll, as parsed by parse-geometric.py, and
+list the records that were added, removed or changed (see rolldiff.py).
+
+Each revision can be a CSV file (per file, or merged), a SQLite
+database, or a directory of these.
+
+e.g.
+  ./diff-rolls.py csv-2013/ csv-2014/
+  ./diff-rolls.py --output changes.txt voterlist-2013.db voterlist-2014.db
+"""
+import itertools
+import argparse
+import codecs
+import sys
+
+import rolldiff
+from voterindex import findSources, readSource
+
+def readRevision(path):
+	return itertools.chain.from_iterable(itertools.imap(readSource, findSources([path])))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("old", type=str, help="Output of parse-geometric.py for the old revision: a CSV file, a SQLite database, or a directory of these")
+	parser.add_argument("new", type=str, help="Output of parse-geometric.py for the new revision")
+	parser.add_argument("--output", type=str, help="Write the differences to this file, instead of the standard output")
+	parser.add_argument("--max-records", type=int, default=1000000, help="Records of the old revision to hold in memory, defaults to 1000000. Beyond this, records are split into partitions on disk, and compared a partition at a time.")
+	parser.add_argument("--tmp-dir", type=str, help="Directory for the partitions, defaults to the system temporary directory")
+	args = parser.parse_args()
+
+	if args.output:
+		out = codecs.open(args.output, 'w', 'utf-8')
+	else:
+		out = codecs.getwriter('utf-8')(sys.stdout)
+
+	writer = rolldiff.diff(readRevision(args.old), readRevision(args.new), out, args.max_records, args.tmp_dir)
+	if args.output:
+		out.close()
+	print >> sys.stderr, '%d added, %d removed, %d changed, %d unchanged.'%(writer.added, writer.removed, writer.changed, writer.unchanged)
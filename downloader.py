@@ -0,0 +1,254 @@
+"""
+Concurrent, resumable downloads over HTTP.
+
+Files are fetched by a pool of worker threads. Each thread keeps its
+connection to a host open, and reuses it for the next file. Requests
+to a host are spaced out, so that we don't hammer the server.
+
+A file is downloaded to <name>.part, and renamed to <name> only once
+it is complete. An interrupted download is resumed from where it
+stopped, using a Range request. A file that exists under its final
+name is therefore always complete.
+
+Failed requests are retried, with an exponential backoff and random
+jitter between tries. Client errors (HTTP 4xx, e.g. a file that is not
+on the server) are not retried, except for timeouts (408) and requests
+refused for coming too often (429).
+"""
+import httplib
+import urlparse
+import threading
+import socket
+import random
+import time
+import sys
+import os
+from multiprocessing.pool import ThreadPool
+
+# ceokarnataka.kar.nic.in has voter lists inside a specific directory.
+# we can get voter lists with a simple get on the URL
+# e.g. http://ceokarnataka.kar.nic.in/ElectionFinalroll2014/PCROLL_2014/English/WOIMG/AC154/AC1540347.pdf
+# here : AC154 -> this is the number for your area
+# (eductaed guess is that AC possibly stands for "assembly constituency")
+#
+urlFmt = 'http://ceokarnataka.kar.nic.in/ElectionFinalroll2014/PCROLL_2014/English/WOIMG/AC%03d/AC%03d%04d.pdf'
+
+# Size of each read from the network
+chunkSize = 64*1024
+
+# Redirects to follow before giving up
+maxRedirects = 5
+
+class FetchError(Exception):
+	pass
+
+class PermanentError(FetchError):
+	# Trying again would get the same answer
+	pass
+
+# Client errors that may go away if the request is made again
+retryStatus = [408, 429]
+
+class RateLimiter(object):
+	# Spaces out the start of requests to the same host by at least
+	# 'interval' seconds, across all threads.
+	def __init__(self, interval):
+		self.interval = interval
+		self.lock = threading.Lock()
+		self.nextSlot = {}
+
+	def wait(self, host):
+		self.lock.acquire()
+		try:
+			now = time.time()
+			slot = max(now, self.nextSlot.get(host, now))
+			self.nextSlot[host] = slot + self.interval
+		finally:
+			self.lock.release()
+		if slot > now:
+			time.sleep(slot - now)
+
+# Messages from the worker threads are written a line at a time
+logLock = threading.Lock()
+
+def log(msg, f=sys.stdout):
+	logLock.acquire()
+	try:
+		f.write(msg + '\n')
+		f.flush()
+	finally:
+		logLock.release()
+
+# Connections are kept per thread, keyed by (scheme, host)
+connections = threading.local()
+
+def getConnection(scheme, netloc, timeout):
+	if not hasattr(connections, 'pool'):
+		connections.pool = {}
+	key = (scheme, netloc)
+	conn = connections.pool.get(key)
+	if conn is None:
+		if scheme == 'https':
+			conn = httplib.HTTPSConnection(netloc, timeout=timeout)
+		else:
+			conn = httplib.HTTPConnection(netloc, timeout=timeout)
+		connections.pool[key] = conn
+	return conn
+
+def dropConnection(scheme, netloc):
+	# The connection is in an unknown state after an error, so
+	# close it. The next request opens a fresh one.
+	if not hasattr(connections, 'pool'):
+		return
+	conn = connections.pool.pop((scheme, netloc), None)
+	if conn is not None:
+		conn.close()
+
+def parseContentRange(value):
+	# 'bytes 100-199/1000' => (100, 1000). Either may be None if
+	# it is not known.
+	start = None
+	total = None
+	if not value:
+		return (start, total)
+	try:
+		(rangeSpec, totalSpec) = value.split()[-1].split('/')
+		if totalSpec != '*':
+			total = int(totalSpec)
+		if rangeSpec != '*':
+			start = int(rangeSpec.split('-')[0])
+	except ValueError:
+		pass
+	return (start, total)
+
+def fetchOnce(url, fname, limiter, timeout):
+	# One attempt at getting url into fname. Raises an exception on
+	# failure. Whatever was received is kept in the .part file, for
+	# the next attempt to resume from.
+	partName = fname + '.part'
+	for redirect in range(maxRedirects):
+		u = urlparse.urlsplit(url)
+		path = u.path or '/'
+		if u.query:
+			path = path + '?' + u.query
+		have = 0
+		if os.path.isfile(partName):
+			have = os.path.getsize(partName)
+		headers = {}
+		if have > 0:
+			headers['Range'] = 'bytes=%d-'%(have)
+
+		limiter.wait(u.netloc)
+		conn = getConnection(u.scheme, u.netloc, timeout)
+		try:
+			conn.request('GET', path, headers=headers)
+			resp = conn.getresponse()
+
+			if resp.status in [301, 302, 303, 307, 308]:
+				resp.read()
+				url = urlparse.urljoin(url, resp.getheader('location'))
+				continue
+
+			length = resp.getheader('content-length')
+			if length is not None:
+				try:
+					length = int(length)
+				except ValueError:
+					raise FetchError('bad Content-Length: %s'%(length))
+
+			if resp.status == 416:
+				# Nothing beyond what we have. The partial file may
+				# be complete already.
+				resp.read()
+				(start, total) = parseContentRange(resp.getheader('content-range'))
+				if total == have:
+					os.rename(partName, fname)
+					return
+				os.remove(partName)
+				raise FetchError('range not satisfiable, restarting')
+			elif resp.status == 206:
+				(start, total) = parseContentRange(resp.getheader('content-range'))
+				if start != have:
+					resp.read()
+					os.remove(partName)
+					raise FetchError('unexpected range from server, restarting')
+				mode = 'ab'
+				expected = total
+				if (expected is None) and (length is not None):
+					expected = have + length
+			elif resp.status == 200:
+				# Server ignored the range, start afresh
+				mode = 'wb'
+				expected = length
+			else:
+				resp.read()
+				if resp.status >= 400 and resp.status < 500 and resp.status not in retryStatus:
+					raise PermanentError('HTTP status %d %s'%(resp.status, resp.reason))
+				raise FetchError('HTTP status %d %s'%(resp.status, resp.reason))
+
+			out = open(partName, mode)
+			try:
+				while True:
+					data = resp.read(chunkSize)
+					if not data:
+						break
+					out.write(data)
+			finally:
+				out.close()
+		except:
+			dropConnection(u.scheme, u.netloc)
+			raise
+
+		got = os.path.getsize(partName)
+		if (expected is not None) and (got != expected):
+			dropConnection(u.scheme, u.netloc)
+			raise FetchError('got %d of %d bytes'%(got, expected))
+		if resp.will_close:
+			dropConnection(u.scheme, u.netloc)
+		os.rename(partName, fname)
+		return
+	raise FetchError('too many redirects')
+
+def backoffDelay(attempt, base, cap):
+	# Exponential backoff with "full jitter" : a random delay of up
+	# to base * 2^attempt seconds, but no more than cap seconds.
+	return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def fetch(url, fname, limiter, retries=10, backoff=1.0, maxBackoff=60.0, timeout=60):
+	# Get url into fname, unless it's already there. Returns True
+	# if the file is available at the end of it.
+	if os.path.isfile(fname):
+		log('File %s exists. Not getting from web'%(url))
+		return True
+	log('Retrieving URL %s... '%(url))
+	for attempt in range(retries):
+		try:
+			fetchOnce(url, fname, limiter, timeout)
+			log('Retrieved %s'%(fname))
+			return True
+		except PermanentError as e:
+			log('  %s : failed : %s'%(url, e))
+			return False
+		except (FetchError, httplib.HTTPException, socket.error, IOError, OSError) as e:
+			log('  %s : try %d (of %d) failed : %s'%(url, attempt+1, retries, e))
+		if attempt+1 < retries:
+			time.sleep(backoffDelay(attempt, backoff, maxBackoff))
+	return False
+
+def fetchAll(items, workers=4, interval=0.5, **kwargs):
+	# Fetch a list of (url, fname) using a pool of worker threads.
+	# Requests to a host are spaced at least 'interval' seconds
+	# apart. Other keyword arguments are passed on to fetch().
+	#
+	# Returns the list of URLs that could not be fetched.
+	limiter = RateLimiter(interval)
+	def fetchItem(item):
+		(url, fname) = item
+		return (url, fetch(url, fname, limiter, **kwargs))
+	pool = ThreadPool(workers)
+	try:
+		results = pool.map(fetchItem, items)
+	finally:
+		pool.close()
+		pool.join()
+	return [url for (url, ok) in results if not ok]
@@ -0,0 +1,130 @@
+"""
+Sidecar index of the EPIC numbers in an XML file.
+
+parse-geometric.py --write-index writes <file>.xml.epics next to the XML
+file. For every record with an EPIC number, it has the page number, the
+index of the voter box on the page (in the order of computeDataRegions)
+and the byte offset of the PAGE element in the XML file:
+
+    # epic index <version> <stamp>
+    REJ5021886 3 17 104522
+
+A debug run for an EPIC then parses only that page, and extracts only
+that box, instead of the whole document.
+
+The stamp covers the XML file (size and modification time), the parser
+and the config for the file. An index whose stamp does not match is
+not used.
+"""
+import re
+import os
+
+indexVersion = 1
+
+rePage = re.compile('<PAGE[\\s>/]')
+
+def sidecarPath(filename):
+	return filename + '.epics'
+
+# Size of the reads when scanning a file for its pages
+blockSize = 1024*1024
+
+def pageOffsets(filename):
+	# Byte offset of each PAGE element in the file, in order. The file
+	# is read a block at a time, with the end of each block kept for
+	# the next, in case a tag is split between them. What is kept is
+	# shorter than a match, so no tag is found twice.
+	keep = len('<PAGE ') - 1
+	offsets = []
+	f = open(filename, 'rb')
+	try:
+		# data starts at this offset in the file
+		pos = 0
+		data = ''
+		while True:
+			block = f.read(blockSize)
+			if not block:
+				break
+			data = data + block
+			for ob in rePage.finditer(data):
+				offsets.append(pos + ob.start())
+			tail = data[-keep:]
+			pos = pos + len(data) - len(tail)
+			data = tail
+	finally:
+		f.close()
+	return offsets
+
+def write(filename, stamp, entries):
+	# entries are (epic, page, box), pages starting at 1
+	offsets = pageOffsets(filename)
+	path = sidecarPath(filename)
+	tmpPath = '%s.%d.tmp'%(path, os.getpid())
+	f = open(tmpPath, 'w')
+	try:
+		print >>f, '# epic index %d %s'%(indexVersion, stamp)
+		for (epic, page, box) in entries:
+			print >>f, '%s %d %d %d'%(epic, page, box, offsets[page-1])
+	finally:
+		f.close()
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(tmpPath, path)
+
+def readStamp(f):
+	header = f.readline().split()
+	if len(header) != 5 or header[:3] != ['#', 'epic', 'index'] or header[3] != '%d'%(indexVersion):
+		return None
+	return header[4]
+
+def isCurrent(filename, stamp):
+	try:
+		f = open(sidecarPath(filename), 'r')
+	except IOError:
+		return False
+	try:
+		return readStamp(f) == stamp
+	finally:
+		f.close()
+
+def lookup(filename, stamp, epic):
+	# Returns the list of (page, box, offset) for the EPIC, or None if
+	# there is no current index for the file.
+	try:
+		f = open(sidecarPath(filename), 'r')
+	except IOError:
+		return None
+	try:
+		if readStamp(f) != stamp:
+			return None
+		found = []
+		for line in f:
+			fields = line.split()
+			if fields[0] == epic:
+				found.append(tuple(map(int, fields[1:])))
+		return found
+	finally:
+		f.close()
+
+def readPage(filename, offset):
+	# Returns the text of the PAGE element at offset, with the XML
+	# declaration of the file (for the encoding) in front of it.
+	f = open(filename, 'rb')
+	try:
+		head = f.readline()
+		if not head.startswith('<?xml'):
+			head = ''
+		f.seek(offset)
+		data = ''
+		while True:
+			block = f.read(65536)
+			if not block:
+				break
+			start = max(0, len(data) - len('</PAGE>'))
+			data = data + block
+			end = data.find('</PAGE>', start)
+			if end >= 0:
+				return head + data[:end+len('</PAGE>')]
+	finally:
+		f.close()
+	raise IOError('No complete PAGE at offset %d in %s'%(offset, filename))
@@ -1,7 +1,5 @@
 #!/bin/bash
-mkdir ceo-mh/csv
-for f in ceo-mh/converted/A*.xml; 
-do 
-	fname=`echo $f | sed -e "s/\/converted\//\/csv\//" | sed -e"s/.xml$/.csv/"`
-	./parse-geometric.py --output=$fname $f; 
-done
+# Process all XML files in ceo-mh/converted, writing a CSV
+# file for each in ceo-mh/csv. Files are processed in parallel,
+# one per CPU.
+./parse-geometric.py --output-dir=ceo-mh/csv ceo-mh/converted/A*.xml
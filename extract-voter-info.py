@@ -2,6 +2,11 @@
 """
 Extract voter list info from all PDF files in conv directory.
 
+With --inflate, the PDF files as downloaded (in ceo-files) are read
+instead, and their FlateDecode streams are decompressed in memory (see
+pdfinflate.py). There is then no need to run convert.sh first. Files
+can be processed in parallel with -j.
+
 The only hardcoded thing in this file is the boothKey.
 
 This spits out data in the following format:
@@ -15,8 +20,15 @@ import os
 import re
 from glob import glob
 import sys
+import argparse
+import multiprocessing
+import itertools
+import mmap
+from collections import deque
 from pprint import pprint
 
+import pdfinflate
+
 # Manually generated from :
 #  ceokarnataka.kar.nic.in/ElectionFinalroll2014/Part_List.aspx?ACNO=154
 # Maps a booth number to an address
@@ -65,108 +77,100 @@ boothKey = {
 348:'Govt. Higer Primary School, Room No-4',
 }
 
-prefixList = []
+prefixList = set()
+
+# A line with text in it, e.g. "10 0 Td (REJ1234567) Tj", and the text
+# of its last Td. The lines of a file are found with one pass of this
+# over the whole file.
+reTdLine = re.compile('^.*Td \((.*)\).*$', re.M)
+# Serial number (also in the "R " or "# " form), or voter card ID -
+# i.e. EPIC number. The two can't match the same text.
+reField = re.compile('Td \((?:([R#]?\s*[0-9]+\s*)|([A-Z]{3}[0-9\s]+))\)')
+# Text that int() takes as a number
+reNumber = re.compile('[-+]?[0-9]+$')
 
-def dumpVoterList(outfile, fname):
+def readBuffers(fname, inflate):
 	"""
-	Takes a voter list PDF file that has text in a non-encoded
-	format (i.e. not using FlateDecoding). Use convert.sh to
-	convert files downloaded from the ceokarnataka.kar.nic.in
-	website.
+	The text of the voter list PDF file, as a list of buffers. Unless
+	inflate is set, the file must have text in a non-encoded format
+	(i.e. not using FlateDecoding), and is memory mapped. Use
+	convert.sh to convert files downloaded from the
+	ceokarnataka.kar.nic.in website.
 	"""
+	if inflate:
+		return pdfinflate.inflateFile(fname)
 	#f = open('conv/AC1540338.pdf', 'r')
-	f = open(fname, 'r')
-	boothNo = fname[-7:-4]
-	slMatch = re.compile('^.*Td \(([R#]?\s*[0-9]+\s*)\).*$')
-	rejMatch = re.compile('^.*Td \(([A-Z]{3}[0-9\s]+)\).*$')
-	tdMatch = re.compile('^.*Td \((.*)\).*$')
+	f = open(fname, 'rb')
+	try:
+		if os.fstat(f.fileno()).st_size == 0:
+			return []
+		return [mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)]
+	finally:
+		f.close()
 
-	allLines = f.readlines()
+def scanVoterList(buffers):
+	"""
+	Yields (slNo, rejNo, name) for the voters in the buffers, in the
+	order they appear. Where a line has more than one Td, the last
+	one counts.
+	"""
 	slNo = None
-	prevTds = []
-	tdSave = 7
-
-	voterList = []
-	for line in allLines:
-		obj = tdMatch.match(line)
-		if obj:
-			newTd = obj.groups()[0]
-			if len(prevTds)>tdSave:
-				prevTds.pop(0)
+	# The last few Td texts
+	prevTds = deque(maxlen=8)
+
+	for buf in buffers:
+		for ob in reTdLine.finditer(buf):
+			newTd = ob.group(1)
 			prevTds.append(newTd)
 			# Convert TD to a number if possible, this
 			# could be the serial number for a voter
 			n = newTd.strip()
-			try:
-				n1 = int(n)
-				#print 'Converted ', n
+			if reNumber.match(n):
 				slNo = n
-			except ValueError:
-				#print 'Unable to convert ', n
-				pass
-			# countDigs = reduce(lambda x,y: x+y, map(lambda x: x.isdigit()+0, '123'), 0)
-
-		# Check if this is a serial number with the "R " or "# " form
-		obj = slMatch.match(line)
-		if obj:
-			slNo = obj.groups()[0].strip()
-			#if slNo.startswith('#'):
-				#slNo = slNo.split(' ')[1].strip()
-
-		# Check if this is a voter card ID - i.e. EPIC number
-		obj = rejMatch.match(line)
-		#if not obj:
-		#	obj = rejMatch2.match(line)
-		#if not obj:
-		#	obj = rejMatch3.match(line)
-		if obj:
-			rejNo = obj.groups()[0].strip()
-			#print '%5s %10s %s'%(slNo, rejNo, prevTds[-2])
-			# PDF file can contain stuff in unicode format
-			# we can't deal with these yet.
-			# If the slNo turns out to be None, then it is
-			# probably in unicode - need to look these up in
-			# the PDF file.
-			# If the name is in unicode, then prevTds[-2]
-			# will not contain the name, it will contain the slNo
-			if slNo is None:
-				slNo = 'U 0'
-			# Store unique prefixes
-			if rejNo[:3] not in prefixList:
-				prefixList.append(rejNo[:3])
-			voterList.append((slNo, rejNo, prevTds[-2].strip()))
-			slNo = None
-
-	def cmpIds(X,Y):
-		x = X[0]
-		y = Y[0]
-		#print 'cmp ', x, y, '=',
-		if not x[0].isdigit():
-			if not y[0].isdigit():
-				try:
-					n1 = int(x[1:]) # x will be in format "R xx" or "# xx" or "#xx"
-				except IndexError:
-					print >> sys.stderr, "Failed for x = ", x
-					sys.exit(1)
-				try:
-					n2 = int(y[1:])
-				except IndexError:
-					print >> sys.stderr, "Failed for y = ", y
-					sys.exit(1)
-				#print n1-n2
-				return n1-n2
-			else:
-				#print '-1'
-				return 1
-		else:
-			if not y[0].isdigit():
-				#print '-1'
-				return -1
-			#print int(x)-int(y)
-			return int(x)-int(y)
-
-	# Sort the voter list
-	voterList.sort(cmp = cmpIds)
+
+			rejNo = None
+			for (serial, epic) in reField.findall(ob.group()):
+				if serial:
+					# A serial number with the "R " or "# " form
+					slNo = serial.strip()
+				else:
+					rejNo = epic.strip()
+
+			# Is there a voter card ID - i.e. EPIC number
+			if rejNo is not None:
+				# PDF file can contain stuff in unicode format
+				# we can't deal with these yet.
+				# If the slNo turns out to be None, then it is
+				# probably in unicode - need to look these up in
+				# the PDF file.
+				# If the name is in unicode, then prevTds[-2]
+				# will not contain the name, it will contain the slNo
+				if slNo is None:
+					slNo = 'U 0'
+				yield (slNo, rejNo, prevTds[-2].strip())
+				slNo = None
+
+def serialKey(voter):
+	# Serial numbers sort as numbers, and ones in the "R xx", "# xx"
+	# or "#xx" form come after the plain ones
+	x = voter[0]
+	if x[0].isdigit():
+		return (0, int(x))
+	return (1, int(x[1:]))
+
+def readVoterList(task):
+	"""
+	Returns (boothNo, voterList, prefixes) for a voter list PDF file,
+	with voterList sorted on serial number, and prefixes the set of
+	EPIC prefixes in it. task is (fname, inflate).
+	"""
+	(fname, inflate) = task
+	boothNo = fname[-7:-4]
+	voterList = sorted(scanVoterList(readBuffers(fname, inflate)), key=serialKey)
+	prefixes = set(map(lambda voter: voter[1][:3], voterList))
+	return (boothNo, voterList, prefixes)
+
+def writeVoterList(outfile, boothNo, voterList):
 	for (slNo, rejNo, name) in voterList:
 		if name == slNo:
 			name = '(Unicode encoded)'
@@ -181,14 +185,42 @@ def dumpVoterList(outfile, fname):
 			boothLoc = "(unknown)"
 		print >>outfile, '%s, %5s, %10s, %s, %s'%(boothNo, slNo, rejNo, name, boothLoc)
 
-fnames = glob('converted/*.pdf')
-fnames.sort()
-outfileName = 'voterlist.csv'
-outfile = open('voterlist.csv', 'w')
-#fnames = ['conv/AC1540334.pdf']
-for fname in fnames:
-	#print fname
-	dumpVoterList(outfile, fname)
-
-# Dump prefixes
-#pprint(prefixList)
+def dumpVoterList(outfile, fname, inflate=False):
+	(boothNo, voterList, prefixes) = readVoterList((fname, inflate))
+	prefixList.update(prefixes)
+	writeVoterList(outfile, boothNo, voterList)
+
+# The guard keeps worker processes on Windows from running this
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--inflate", help="Read the PDF files as downloaded, from ceo-files, and decompress them in memory, instead of reading the files made by convert.sh", action="store_true")
+	parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of files to process in parallel, defaults to 1")
+	args = parser.parse_args()
+
+	if args.inflate:
+		fnames = glob('ceo-files/AC*.pdf')
+	else:
+		fnames = glob('converted/*.pdf')
+	fnames.sort()
+	outfileName = 'voterlist.csv'
+	outfile = open('voterlist.csv', 'w')
+	#fnames = ['conv/AC1540334.pdf']
+	tasks = map(lambda fname: (fname, args.inflate), fnames)
+	pool = None
+	if args.jobs > 1:
+		pool = multiprocessing.Pool(args.jobs)
+		results = pool.imap(readVoterList, tasks)
+	else:
+		results = itertools.imap(readVoterList, tasks)
+	# Results come in the order of the files
+	for (boothNo, voterList, prefixes) in results:
+		#print fname
+		prefixList.update(prefixes)
+		writeVoterList(outfile, boothNo, voterList)
+	if pool is not None:
+		pool.close()
+		pool.join()
+	outfile.close()
+
+	# Dump prefixes
+	#pprint(prefixList)
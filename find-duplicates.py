@@ -0,0 +1,39 @@
+#!/usr/bin/python
+"""
+Find duplicate records in the output of parse-geometric.py: records
+with the same EPIC number, and records with the same name, relative's
+name and age but different EPIC numbers (see dedupe.py).
+
+e.g.
+  ./find-duplicates.py csv/
+  ./find-duplicates.py --output duplicates.txt voterlist-154.db voterlist-155.db
+"""
+import itertools
+import argparse
+import codecs
+import sys
+
+import dedupe
+from voterindex import findSources, readSource
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("sources", type=str, nargs='+', help="CSV files or SQLite databases written by parse-geometric.py, or directories containing them")
+	parser.add_argument("--output", type=str, help="Write the duplicates to this file, instead of the standard output")
+	parser.add_argument("--max-records", type=int, default=1000000, help="Records to sort in memory, defaults to 1000000. Beyond this, records are sorted in runs on disk, and the runs are merged.")
+	parser.add_argument("--tmp-dir", type=str, help="Directory for the runs, defaults to the system temporary directory")
+	args = parser.parse_args()
+
+	if args.output:
+		out = codecs.open(args.output, 'w', 'utf-8')
+	else:
+		out = codecs.getwriter('utf-8')(sys.stdout)
+
+	records = itertools.chain.from_iterable(itertools.imap(readSource, findSources(args.sources)))
+	writer = dedupe.findDuplicates(records, out, args.max_records, args.tmp_dir)
+	if args.output:
+		out.close()
+	counts = writer.counts
+	print >> sys.stderr, 'EPIC numbers: %d exact, %d near. Names: %d exact, %d near.'%(
+		counts.get(('epic', 'exact'), 0), counts.get(('epic', 'near'), 0),
+		counts.get(('name', 'exact'), 0), counts.get(('name', 'near'), 0))
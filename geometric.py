@@ -0,0 +1,1413 @@
+"""
+Geometric processing of XML files generated by pdftoxml.
+
+Voter info is kept in boxes on each page. The boxes are found from
+the vector file that pdftoxml writes for every page, and the text
+that falls in each box is classified into the fields of a voter
+record.
+
+This is used by parse-geometric.py. The functions here can also be
+used by other scripts that need to process voter lists.
+"""
+import xml.etree.ElementTree as ET
+try:
+	# Faster parser, used for the vector files
+	import xml.etree.cElementTree as cET
+except ImportError:
+	cET = ET
+import re
+import math
+from pprint import pprint
+import sys
+import codecs
+import string
+from copy import copy
+import os
+import bisect
+import array
+import glob
+import traceback
+import multiprocessing
+import itertools
+import json
+import time
+
+import cache
+import blockfile
+import epicindex
+import voterdb
+import stats
+
+config = {}
+
+# Timing and counters for the current file. This does nothing,
+# unless enabled by resetStats(True)
+runStats = stats.NullStats()
+
+def resetStats(enabled):
+	global runStats
+	if enabled:
+		runStats = stats.Stats()
+	else:
+		runStats = stats.NullStats()
+	return runStats
+
+def loadConfig():
+	global config
+	ign = {}
+	execfile('config.py', ign, config)
+
+def getConfig(filename):
+	filename = os.path.basename(filename)
+	filename = filename.replace('.xml','')
+	global config
+	# start off with defaults
+	retval = copy(config['default'])
+	# Apply overrides
+	try:
+		thisOverride = config['override'][filename]
+		for kv in thisOverride.keys():
+			retval[kv] = thisOverride[kv]
+	except:
+		pass
+	return retval
+
+class ShapeLoader(object):
+	# Parser target that reads the GROUPs of a vector file as it is
+	# parsed, without building a tree. Only the GROUPs that findRects
+	# looks at - 5 point (rectangles) and 2 point (lines) - are kept,
+	# as lists of (x, y).
+	def __init__(self):
+		self.groups = []
+		self.depth = 0
+		self.points = None
+
+	def start(self, tag, attrib):
+		self.depth = self.depth + 1
+		if self.depth == 2:
+			if tag == 'GROUP':
+				self.points = []
+		elif (self.depth == 3) and (self.points is not None):
+			self.points.append(attrib)
+
+	def end(self, tag):
+		if (self.depth == 2) and (self.points is not None):
+			if len(self.points) in (2, 5):
+				self.groups.append(map(lambda a: (float(a['x']), float(a['y'])), self.points))
+			self.points = None
+		self.depth = self.depth - 1
+
+	def data(self, data):
+		pass
+
+	def close(self):
+		return self.groups
+
+def loadShapes(path):
+	# Returns the 5 and 2 point GROUPs in the vector file at path
+	parser = cET.XMLParser(target=ShapeLoader())
+	f = open(path, 'rb')
+	try:
+		while True:
+			block = f.read(65536)
+			if not block:
+				break
+			parser.feed(block)
+	finally:
+		f.close()
+	return parser.close()
+
+def shapePath(filename, thisPage):
+	# Path of the vector file included at the end of the page. The
+	# href is relative to the XML file; if there is no such file,
+	# maybe the path in the file is OK
+	href = thisPage.getchildren()[-1].attrib['href']
+	path = os.path.join(os.path.dirname(filename), href)
+	if os.path.exists(path):
+		return path
+	return href
+
+def findRects(groups, minW, maxW, minH, maxH):
+	# groups are lists of (x, y), as loaded by loadShapes
+	rects = []
+	for gc in groups:
+		if len(gc)==5:
+			xvals = map(lambda v:v[0], gc)
+			yvals = map(lambda v:v[1], gc)
+			x1 = min(xvals)
+			y1 = min(yvals)
+			x2 = max(xvals)
+			y2 = max(yvals)
+			w = x2-x1
+			h = y2-y1
+			if w > minW and w < maxW and h > minH and h < maxH:
+				rects.append([x1, y1, x2, y2])
+
+	# Extract lines from the 2 point GROUP that satisfy our size
+	# requirements, and are horizontal OR vertical.
+	#
+	# Each line [x1,y1,x2,y2] is stored such that
+	#       x1<=x2 and y1<=y2
+	#
+	hlines = []
+	vlines = []
+	for gc in groups:
+		if len(gc)==2:
+			(x1, y1) = gc[0]
+			(x2, y2) = gc[1]
+			if x1 == x2:
+				l = math.fabs(y2-y1)
+				if l>minH and l<maxH:
+					if y1<y2:
+						vlines.append([x1,y1,x2,y2])
+					else:
+						vlines.append([x1,y2,x2,y1])
+			if y1 == y2:
+				l = math.fabs(x2-x1)
+				if l>minW and l<maxW:
+					if x1<x2:
+						hlines.append([x1,y1,x2,y2])
+					else:
+						hlines.append([x2,y1,x1,y2])
+
+	# Vertical sort function, based on Y
+	def sortV(l1, l2):
+		if l1[1]<l2[1]:
+			return -1
+		elif l1[1]>l2[1]:
+			return 1
+		return 0
+
+	# Sort lines by Y. This will help the next phase.
+	hlines.sort(cmp=sortV)
+	vlines.sort(cmp=sortV)
+
+	# Coordinate value tolerance based match.
+	def coordMatch(v1, v2):
+		if math.fabs(v1-v2)<0.5:
+			return True
+		return False
+
+	# Lines are looked up by their end points. Each end point is hashed
+	# into a grid cell that is as wide as the coordMatch tolerance.
+	# Any point that passes coordMatch against it is then in the same
+	# cell, or in one of the 8 cells around it.
+	tolerance = 0.5
+	def cellOf(x, y):
+		return (int(math.floor(x/tolerance)), int(math.floor(y/tolerance)))
+
+	def buildIndex(lines, xi, yi):
+		index = {}
+		for pos in range(len(lines)):
+			l = lines[pos]
+			index.setdefault(cellOf(l[xi], l[yi]), []).append(pos)
+		return index
+
+	# Returns the position of the first line (in sorted order) that is
+	# still available, has its end point (xi,yi) at (x,y), and passes
+	# the optional check. This is what a linear scan of the list
+	# would return.
+	def findLine(lines, alive, index, xi, yi, x, y, check=None):
+		(cx, cy) = cellOf(x, y)
+		found = None
+		for dx in [-1, 0, 1]:
+			for dy in [-1, 0, 1]:
+				for pos in index.get((cx+dx, cy+dy), []):
+					if (found is not None) and (pos >= found):
+						break
+					if not alive[pos]:
+						continue
+					l = lines[pos]
+					if coordMatch(x, l[xi]) and coordMatch(y, l[yi]):
+						if (check is None) or check(l):
+							found = pos
+							break
+		return found
+
+	hStarts = buildIndex(hlines, 0, 1)
+	vStarts = buildIndex(vlines, 0, 1)
+	vEnds = buildIndex(vlines, 2, 3)
+	hAlive = [True]*len(hlines)
+	vAlive = [True]*len(vlines)
+
+	# Combine the lines to create rectangles where possible.
+	# A rectangle needs 2 horiz and 2 vert lines
+	#
+	# We start with a horizontal line (hcand1). Next, we find
+	# an attachable vertical line vcand1. hcand2 is then chosen
+	# to fit vcand1. vcand2 is chosen to attach to hcand2 and
+	# hcand1.
+	#
+	#          hcand1
+	#    +-----------------------+
+	#    |                       |
+	#  v |                       |v
+	#  c |                       |c
+	#  a |                       |a
+	#  n |                       |n
+	#  d |                       |d
+	#  1 |                       |2
+	#    +-----------------------+
+	#          hcand2
+	#
+	# Lines that have been used up are marked as not alive, rather
+	# than being removed from the lists.
+	#
+	for h1 in range(len(hlines)):
+		if not hAlive[h1]:
+			continue
+		hcand1 = hlines[h1]
+		h2 = None
+		v2 = None
+		# find a vertical line that starts at first corner
+		v1 = findLine(vlines, vAlive, vStarts, 0, 1, hcand1[0], hcand1[1])
+		if v1 is not None:
+			vcand1 = vlines[v1]
+			# find a horizontal line that starts at first corner
+			h2 = findLine(hlines, hAlive, hStarts, 0, 1, vcand1[2], vcand1[3])
+		if h2 is not None:
+			hcand2 = hlines[h2]
+			# find a vertical line that ends at the end of hcand2,
+			# and starts at the end of hcand1
+			v2 = findLine(vlines, vAlive, vEnds, 2, 3, hcand2[2], hcand2[3],
+				lambda vl: coordMatch(vl[0], hcand1[2]) and coordMatch(vl[1], hcand1[3]))
+		if v2 is not None:
+			rects.append([hcand1[0], hcand1[1], hcand2[2], hcand2[3]])
+			hAlive[h2] = False
+			vAlive[v1] = False
+			vAlive[v2] = False
+		hAlive[h1] = False
+
+	return rects
+
+def computeDataRegions(filename, cfg, thisPage, layout=None):
+	# Every page has a xi:include attribute at the end of the page
+	# This includes a vector XML file. The XML file contains lines and 
+	# rectangles. 
+	#
+	# pdf2xml conversion results in this being stored in 
+	# the <filename>_data directory.
+	#
+	# We use this vector file to load rectangles (5 point GROUP).
+	# The file is read as it is parsed, keeping only the GROUPs
+	# that may be rectangles or lines (see loadShapes)
+	#
+	# The rectangles that are close to our target box size (with some
+	# fuzz) are retained.
+	#
+	# Line GROUPs in the vector file are taken.  Lines that are
+	# horizontal OR vertical and satisfy the target box size requirements
+	# are retained.  Out of these, rectangles are created where possible.
+	#
+	# The rectangles from the 5 point GROUP and the 2 point GROUP are
+	# the final rectangles that are considered to contain voter data.
+	#
+	# If a layout template is given, and the page matches it, the
+	# rectangles of the template are used instead.
+	#
+	path = shapePath(filename, thisPage)
+	rectsVoter = None
+	if layout is not None:
+		with runStats.timer('shapes'):
+			rectsVoter = layout.match(path)
+		if rectsVoter is not None:
+			runStats.count('layoutPages')
+
+	if rectsVoter is None:
+		with runStats.timer('shapes'):
+			groups = loadShapes(path)
+
+		minW = cfg['infoBoxWidthRange'][0]
+		maxW = cfg['infoBoxWidthRange'][1]
+		minH = cfg['infoBoxHeightRange'][0]
+		maxH = cfg['infoBoxHeightRange'][1]
+
+		with runStats.timer('findRects'):
+			rectsVoter = findRects(groups, minW, maxW, minH, maxH)
+	runStats.count('rects', len(rectsVoter))
+	def cmpRects(r1,r2):
+		r1_y = r1[1]
+		r2_y = r2[1]
+		if r1_y < r2_y:
+			return -1
+		elif r1_y > r2_y:
+			return 1
+		r1_x = r1[0]
+		r2_x = r2[0]
+		if r1_x < r2_x:
+			return -1
+		elif r1_x > r2_x:
+			return 1
+		return 0
+	# Sort with Y first, then X
+	rectsVoter.sort(cmp=cmpRects)
+	if layout is not None:
+		layout.update(rectsVoter)
+	return rectsVoter
+
+#
+# Layout templates
+#
+# Every page of a roll usually has the same grid of voter boxes. A
+# LayoutTemplate keeps the boxes found on a page. Later pages are
+# checked against it, with a scan of the page's vector file that is
+# cheaper than loading it and finding the rectangles again:
+#
+#  - every 5 point GROUP and line that findRects would take (i.e. of
+#    the size of a box) must be the outline or a side of a box in
+#    the template. Any other means the page has boxes the template
+#    does not.
+#  - every box in the template must be on the page, as an outline, or
+#    as 4 sides that meet as findRects needs them to.
+#
+# The boxes are then returned as findRects would have found them on
+# the page. Pages that don't match (e.g. a last page with fewer boxes,
+# a page with more, or boxes that moved) are processed in full.
+#
+# Coordinates are compared as numbers, and taken to be the same within
+# layoutTolerance. Sides of boxes made of lines can be apart at the
+# corners by twice the tolerance of findRects (see coordMatch there).
+#
+
+layoutTolerance = 1.0
+
+reGroup = re.compile('<GROUP[^>]*>(.*?)</GROUP>', re.S)
+rePoint = re.compile('<[ML] x="([^"]*)" y="([^"]*)"')
+
+def nearTo(p1, p2, tolerance):
+	# Points, or lists of coordinates, that are within tolerance
+	for i in range(len(p1)):
+		if math.fabs(p1[i]-p2[i]) >= tolerance:
+			return False
+	return True
+
+class LayoutTemplate(object):
+	def __init__(self, sizes, rects=[]):
+		# sizes are the (infoBoxWidthRange, infoBoxHeightRange) that
+		# the boxes are found with
+		self.sizes = sizes
+		self.rects = []
+		self.cells = {}
+		# Set when the template is replaced, so that it is saved
+		self.changed = False
+		self.update(rects)
+
+	def cellOf(self, x, y):
+		return (int(math.floor(x/layoutTolerance)), int(math.floor(y/layoutTolerance)))
+
+	def update(self, rects):
+		# Called with the boxes of a page that was processed in full.
+		# These become the template if there are more of them, so
+		# that a page with a partial grid is never the template.
+		if len(rects) <= len(self.rects):
+			return
+		self.rects = map(list, rects)
+		# The outline and the sides of each box, as [x1, y1, x2, y2]
+		# with x1<=x2 and y1<=y2, in a grid by their first point
+		self.cells = {}
+		for i in range(len(self.rects)):
+			(x1, y1, x2, y2) = self.rects[i]
+			sides = {
+				'box' : [x1, y1, x2, y2],
+				'top' : [x1, y1, x2, y1],
+				'left' : [x1, y1, x1, y2],
+				'bottom' : [x1, y2, x2, y2],
+				'right' : [x2, y1, x2, y2] }
+			for (side, seg) in sides.items():
+				self.cells.setdefault(self.cellOf(seg[0], seg[1]), []).append((i, side, seg))
+		self.changed = True
+
+	def find(self, seg, sides):
+		# The (box, side) of the template that seg is, or None
+		(cx, cy) = self.cellOf(seg[0], seg[1])
+		for dx in [-1, 0, 1]:
+			for dy in [-1, 0, 1]:
+				for (i, side, t) in self.cells.get((cx+dx, cy+dy), []):
+					if (side in sides) and nearTo(seg, t, layoutTolerance):
+						return (i, side)
+		return None
+
+	def match(self, path):
+		# Returns the boxes on the page whose vector file is at path,
+		# if they are those of the template, or None.
+		if not self.rects:
+			return None
+		((minW, maxW), (minH, maxH)) = self.sizes
+		f = open(path, 'rb')
+		try:
+			data = f.read()
+		finally:
+			f.close()
+
+		# The outlines and sides found on the page, by (box, side)
+		found = {}
+		for group in reGroup.findall(data):
+			points = rePoint.findall(group)
+			if len(points) != group.count('<'):
+				# Not just M and L points; leave it to loadShapes
+				return None
+			if len(points) not in (2, 5):
+				continue
+			points = map(lambda p: (float(p[0]), float(p[1])), points)
+			# Take the GROUPs that findRects would take
+			if len(points) == 5:
+				xvals = map(lambda v:v[0], points)
+				yvals = map(lambda v:v[1], points)
+				seg = [min(xvals), min(yvals), max(xvals), max(yvals)]
+				w = seg[2]-seg[0]
+				h = seg[3]-seg[1]
+				if not (w > minW and w < maxW and h > minH and h < maxH):
+					continue
+				sides = ['box']
+			else:
+				((x1, y1), (x2, y2)) = points
+				seg = [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
+				if (x1 == x2) and (seg[3]-seg[1] > minH) and (seg[3]-seg[1] < maxH):
+					sides = ['left', 'right']
+				elif (y1 == y2) and (seg[2]-seg[0] > minW) and (seg[2]-seg[0] < maxW):
+					sides = ['top', 'bottom']
+				else:
+					continue
+			key = self.find(seg, sides)
+			if (key is None) or (key in found):
+				# Not in the template, or there twice
+				return None
+			found[key] = seg
+
+		rects = []
+		for i in range(len(self.rects)):
+			box = found.get((i, 'box'))
+			lines = map(lambda side: found.get((i, side)), ['top', 'left', 'bottom', 'right'])
+			if box is not None:
+				if lines != [None, None, None, None]:
+					return None
+				rects.append(box)
+				continue
+			if None in lines:
+				return None
+			# The sides must meet as findRects joins them (hcand1,
+			# vcand1, hcand2, vcand2 there)
+			(h1, v1, h2, v2) = lines
+			if not (nearTo(v1[0:2], h1[0:2], 0.5) and nearTo(h2[0:2], v1[2:4], 0.5) and
+					nearTo(v2[2:4], h2[2:4], 0.5) and nearTo(v2[0:2], h1[2:4], 0.5)):
+				return None
+			rects.append([h1[0], h1[1], h2[2], h2[3]])
+		return rects
+
+def layoutKey(filename, cfg):
+	# Templates are shared by the files of an AC (or kept per file, if
+	# the name does not give the AC), and depend on the box sizes
+	(name, ac, booth) = rollInfo(filename)
+	if ac:
+		name = 'AC' + ac
+	return (name, (cfg['infoBoxWidthRange'], cfg['infoBoxHeightRange']))
+
+def loadLayout(filename, cfg, opts):
+	# The layout template to use for the file, with --layout-template.
+	# With --cache, the saved template of the AC is the starting point.
+	if not opts.layout_template:
+		return None
+	(name, sizes) = layoutKey(filename, cfg)
+	if opts.cache is not None:
+		saved = cache.loadLayout(opts.cache, name)
+		if (saved is not None) and (saved['sizes'] == sizes):
+			layout = LayoutTemplate(sizes, saved['rects'])
+			layout.changed = False
+			return layout
+	return LayoutTemplate(sizes)
+
+def saveLayout(filename, cfg, opts, layout):
+	if (layout is None) or (opts.cache is None) or (not layout.changed):
+		return
+	(name, sizes) = layoutKey(filename, cfg)
+	cache.storeLayout(opts.cache, name, {'sizes' : sizes, 'rects' : layout.rects})
+	layout.changed = False
+
+#
+# Patterns used to classify the text in a box. These are compiled once,
+# rather than for every box.
+#
+reVoterId = re.compile('[A-Z].*[0-9]{6,}')
+reSerial = re.compile("[0-9]+")
+# Labels that start a field. Words seem to be getting split in the PDF,
+# so a label only needs to be at the start of a token. The labels
+# start differently, so a token can match at most one of them.
+reLabel = re.compile("(?P<name>Elector's)|(?P<relative>(?P<relation>Father|Husband|Mother)'s)|(?P<residence>House)|(?P<age>Age)|(?P<sex>Sex)")
+# Geometric constraint: these labels are aligned to the left
+leftLabels = set(['name', 'relative', 'residence', 'age'])
+reHouseNo = re.compile('^No\.')
+
+# Keywords that will not make it into the data. They are removed
+# one after the other, in this order.
+blacklist = ['Name',':', 'Photo','Not', 'Available']
+blacklistSet = set(blacklist)
+reBlacklist = re.compile('|'.join(map(re.escape, blacklist)))
+
+class VoterRecord(object):
+	# A voter record. Fields can be read and set as attributes, or as
+	# for a dict (info['name']).
+	#
+	# 'box' is the index of the voter box on the page. 'file', 'ac' and
+	# 'booth' are set by outputs that merge files. 'debug' has the
+	# coordinates of the tokens that went into each field, and of the
+	# rejected tokens (labels), if these were asked for (see
+	# makeGeometryMatch); otherwise it is None. Records are kept
+	# without it, as it takes several times the memory of the fields.
+	__slots__ = ['page', 'serial', 'epic', 'name', 'age', 'sex', 'relation',
+	             'relative', 'residence', 'box', 'file', 'ac', 'booth', 'debug']
+
+	def __init__(self, page):
+		self.page = page
+		self.serial = ''
+		self.epic = ''
+		self.name = ''
+		self.age = ''
+		self.sex = ''
+		self.relation = ''
+		self.relative = ''
+		self.residence = ''
+		self.box = None
+		self.file = ''
+		self.ac = ''
+		self.booth = ''
+		self.debug = None
+
+	def __getitem__(self, key):
+		return getattr(self, key)
+
+	def __setitem__(self, key, value):
+		setattr(self, key, value)
+
+	def __getstate__(self):
+		return tuple(map(lambda k: getattr(self, k), VoterRecord.__slots__))
+
+	def __setstate__(self, state):
+		for (k, v) in zip(VoterRecord.__slots__, state):
+			setattr(self, k, v)
+
+	def toDict(self):
+		# The fields of the record (and 'debug', if it has it)
+		d = dict(map(lambda k: (k, getattr(self, k)), fieldOrder))
+		if self.debug is not None:
+			d['debug'] = self.debug
+		return d
+
+def recordFromRow(row, fields=None):
+	# A VoterRecord from the values of its fields, in the order of
+	# fieldOrder (or 'fields')
+	if fields is None:
+		fields = fieldOrder
+	info = VoterRecord(None)
+	for (k, v) in zip(fields, row):
+		setattr(info, k, v)
+	return info
+
+def extractVoterInfo(cfg, textRect, tokens, textNodes, pageNo, debugMatch, geometryMatch=None):
+	# textNodes are the indices of the tokens (a PageTokens) in the box.
+	# geometryMatch tells if the record gets the coordinates of its
+	# tokens (see VoterRecord); it defaults to debugMatch.
+	if len(textNodes) == 0:
+		runStats.count('emptyBoxes')
+		return None
+	v_tolerance = cfg['lineSeparation']
+
+	# Work on (y, x, token index)
+	ys = tokens.y
+	xs = tokens.x
+	nodes = map(lambda i: (ys[i], xs[i], i), textNodes)
+
+	# Text within v_tolerance of each other is on the same line. As
+	# this comparison is not transitive, it can't be turned into a
+	# sort key without changing the order in some boxes.
+	def cmpBoxFields(a, b):
+		y1 = a[0]
+		y2 = b[0]
+		if math.fabs(y1-y2) > v_tolerance:
+			if y1 < y2:
+				return -1
+			elif y1 > y2:
+				return 1
+		x1 = a[1]
+		x2 = b[1]
+		if x1 < x2:
+			return -1
+		elif x1 > x2:
+			return 1
+		return 0
+
+	nodes.sort(cmp=cmpBoxFields)
+
+	boxNodes = copy(nodes)
+	text = tokens.text
+
+	info = VoterRecord(pageNo)
+
+	# First item in the list needs to be the serial number
+	ob = reSerial.match(text[nodes[0][2]])
+	if ob:
+		info.serial = ob.group()
+		nodes.pop(0)
+	else:
+		# If the first item is not a serial number, then
+		# keep adding till you find the number
+		# This handles the case where there's an extra "(S)"
+		# No idea what this stands for !
+		serial = text[nodes[0][2]]
+		idx = 1
+		while True:
+			#print 'considering :',text[nodes[idx][2]]
+			ob = reSerial.match(text[nodes[idx][2]])
+			if ob:
+				#print 'matched'
+				serial = serial + ' ' + text[nodes[idx][2]]
+				info.serial = serial
+				idx = idx + 1
+				break
+			serial = serial + ' ' + text[nodes[idx][2]]
+			idx = idx + 1
+			if len(serial)>10:
+				print '!!! ERROR - invalid serial'
+				runStats.count('invalidSerials')
+				return None
+		del nodes[:idx]
+
+	# Next item is the EPIC number. This may be missed in
+	# some nodes!
+	ob = reVoterId.match(text[nodes[0][2]])
+	if ob:
+		info.epic = ob.group()
+		nodes.pop(0)
+
+	# Text of the fields that follow labels
+	values = {'name' : '', 'relative' : '', 'residence' : '', 'age' : '', 'sex' : ''}
+
+	if geometryMatch is None:
+		geometryMatch = debugMatch
+	geometry = None
+	if geometryMatch(pageNo, info.epic):
+		geometry = dict(map(lambda k: (k, []), fieldOrder))
+		geometry['rejected'] = []
+		info.debug = geometry
+	rejected = 0
+
+	# One pass over the remaining text: drop keywords, and either
+	# switch to the field of a label, or add the text to the
+	# current field.
+	left = textRect[0]+20
+	appendTo = "name" # By default after EPIC
+	for (y, x, i) in nodes:
+		txt = text[i]
+		if (txt is None) or (txt in blacklistSet):
+			continue
+		txt = txt.strip()
+		if reBlacklist.search(txt):
+			for token in blacklist:
+				txt = txt.replace(token, '')
+				txt = txt.strip()
+		if len(txt)==0:
+			continue
+
+		ob = reLabel.match(txt)
+		if ob:
+			label = ob.lastgroup
+			if (label in leftLabels) and (x>left):
+				ob = None
+		if ob:
+			appendTo = label
+			if label == 'relative':
+				info.relation = ob.group('relation')
+			rejected = rejected + 1
+			if geometry is not None:
+				geometry['rejected'].append([x, y, tokens.width[i], tokens.height[i]])
+			continue
+
+		if (len(values[appendTo])==0) and (appendTo=='residence'):
+			txt = reHouseNo.sub('', txt)
+		values[appendTo] =( '%s %s'%(values[appendTo], txt)).strip()
+		if geometry is not None:
+			geometry[appendTo].append([x, y, tokens.width[i], tokens.height[i]])
+
+	info.name = values['name']
+	info.relative = values['relative']
+	info.residence = values['residence']
+	info.age = values['age']
+	info.sex = values['sex']
+
+	runStats.count('rejectedNodes', rejected)
+
+	if debugMatch(pageNo, info.epic):
+		print 'Matching record at page %3d'%(pageNo)
+		indent = '  '
+		print indent,
+		print text[boxNodes[0][2]],
+		prevNode = boxNodes[0]
+		for node in boxNodes[1:]:
+			if node[0]>(prevNode[0]+v_tolerance):
+				print 
+				print indent,
+			try:
+				print text[node[2]],
+			except:
+				print 'Unicode',
+			prevNode = node
+		print
+		print 'Output for record:'
+		pprint(info.toDict())
+
+	#print info
+	return info
+
+# Tolerance used when checking if a token lies inside a rect
+pointEps = 0.1
+
+class PageTokens(object):
+	# The TOKENs of a page, converted once when the page is read. The
+	# rest of the parser works on this, rather than the XML nodes.
+	#
+	# Token i is at (x[i], y[i]), has size width[i] x height[i],
+	# and text text[i]. Coordinates are kept in parallel arrays of
+	# doubles, which take much less memory than a node per token.
+	__slots__ = ['x', 'y', 'width', 'height', 'text']
+
+	def __init__(self, page):
+		self.x = array.array('d')
+		self.y = array.array('d')
+		self.width = array.array('d')
+		self.height = array.array('d')
+		self.text = []
+		for tok in page.iter('TOKEN'):
+			attrib = tok.attrib
+			self.x.append(float(attrib['x']))
+			self.y.append(float(attrib['y']))
+			self.width.append(float(attrib['width']))
+			self.height.append(float(attrib['height']))
+			self.text.append(tok.text)
+
+	def __len__(self):
+		return len(self.text)
+
+def buildTokenIndex(tokens):
+	# Sort-and-sweep index over the tokens of a page.
+	#
+	# The tokens are sorted on Y. A rect then only needs to look at
+	# the band of tokens that fall within its Y range, found via
+	# a binary search, instead of looking at every token on the page.
+	keys = zip(tokens.y, tokens.x, xrange(len(tokens)))
+	keys.sort()
+	yvals = map(lambda k:k[0], keys)
+	return (yvals, keys)
+
+def tokensInRect(index, r):
+	# Returns the indices of the tokens whose (x,y) lies in rect r,
+	# in document order. This is the same as testing every token
+	# against the rect, with a tolerance of pointEps.
+	yvals, keys = index
+	lo = bisect.bisect_left(yvals, r[1]-pointEps)
+	hi = bisect.bisect_right(yvals, r[3]-pointEps)
+	xmin = r[0]-pointEps
+	xmax = r[2]-pointEps
+	matched = []
+	for (y, x, idx) in keys[lo:hi]:
+		if x>=xmin and x<=xmax:
+			matched.append(idx)
+	matched.sort()
+	return matched
+
+def getVoterInfo(cfg, tokens, rects, pageNo, debugMatch, geometryMatch=None):
+	# tokens are the PageTokens of the page
+	with runStats.timer('assign'):
+		index = buildTokenIndex(tokens)
+	runStats.count('tokens', len(tokens))
+
+	voterInfo = []
+	for (boxNo, thisRect) in enumerate(rects):
+		# Figure out all the text nodes that belong to
+		# this rect
+		with runStats.timer('assign'):
+			thisRectNodes = tokensInRect(index, thisRect)
+
+		# 
+		with runStats.timer('extract'):
+			info = extractVoterInfo(cfg, thisRect, tokens, thisRectNodes, pageNo, debugMatch, geometryMatch)
+		if info is not None:
+			# Position of the box on the page, for the EPIC index
+			info.box = boxNo
+			voterInfo.append(info)
+	runStats.count('records', len(voterInfo))
+	return voterInfo
+
+def iterPages(filename, stream):
+	# Yields (pageNo, PAGE element) for every page in the document,
+	# page numbers starting at 1.
+	#
+	# Without 'stream', the whole document is parsed up front, and
+	# all PAGE elements are alive till the end of the run.
+	#
+	# With 'stream', the document is parsed incrementally. Each PAGE
+	# is handed out as soon as its closing tag is seen, and is freed
+	# once the caller is done with it. Memory use then depends on the
+	# size of a page, not the size of the document.
+	if not stream:
+		with runStats.timer('parse'):
+			doc = ET.parse(filename)
+			pages = doc.getroot().findall('PAGE')
+		for pageInfo in zip(range(len(pages)),pages):
+			yield pageInfo[0]+1, pageInfo[1]
+		return
+
+	root = None
+	pageNo = 0
+	# Parsing is interleaved with processing of pages, so only
+	# the time spent in here is counted as parse time
+	start = runStats.clock()
+	for event, elem in ET.iterparse(filename, events=('start', 'end')):
+		if root is None:
+			root = elem
+			continue
+		if event != 'end' or elem.tag != 'PAGE':
+			continue
+		pageNo = pageNo + 1
+		runStats.addSince('parse', start)
+		yield pageNo, elem
+		start = runStats.clock()
+		# Drop the page (and anything before it) from the tree,
+		# so that the nodes can be reclaimed
+		elem.clear()
+		root.clear()
+	runStats.addSince('parse', start)
+
+sep = '|' # field separator
+
+fieldOrder = ['page', 'serial', 'epic', 'name', 'age', 'sex', 'relation', 
+              'relative', 'residence' ]
+
+# Merged batch output identifies the source of every record
+mergedFieldOrder = ['file', 'ac', 'booth'] + fieldOrder
+
+def writeHeader(f, sep, fields=fieldOrder):
+	print >>f, string.join(fields, sep)
+
+def formatRecords(voterInfo, sep, fields=fieldOrder):
+	# Returns the line of text for each record
+	# '%s' converts the page number to a string
+	return map(lambda vInfo: string.join(map(lambda fieldName: '%s'%(getattr(vInfo, fieldName)), fields), sep), voterInfo)
+
+def writeRecords(f, voterInfo, sep, fields=fieldOrder):
+	# The records are written out in one go, which is much quicker
+	# than writing each line (and each end of line) on its own
+	if not voterInfo:
+		return
+	lines = formatRecords(voterInfo, sep, fields)
+	lines.append('')
+	f.write(string.join(lines, '\n'))
+
+def makeDebugMatch(debug, epic, page):
+	# Returns a function that tells if debug info must be dumped
+	# for the record with the given page number and EPIC.
+	def debugMatch(pageNo, thisEpic):
+		if not debug:
+			return False
+
+		# debug all ?
+		if (epic is None) and (page is None):
+			return True
+
+		if (epic is not None) and (page is not None):
+			if (epic == thisEpic) and (page == pageNo):
+				return True
+			return False
+
+		if (epic is not None) and (epic == thisEpic):
+			return True
+
+		if (page is not None) and (page == pageNo):
+			return True
+
+		return False
+	return debugMatch
+
+def makeGeometryMatch(opts, debugMatch):
+	# Returns a function that tells if the record with the given page
+	# number and EPIC gets the coordinates of its tokens: for debug
+	# output, or to annotate the page of the source PDF (-p and -s).
+	annotatePage = None
+	if opts.source_pdf is not None:
+		annotatePage = opts.page
+	def geometryMatch(pageNo, thisEpic):
+		return (pageNo == annotatePage) or debugMatch(pageNo, thisEpic)
+	return geometryMatch
+
+def extractFile(filename, opts):
+	# Yields the records of every page in the file, a page at a time.
+	#
+	# opts carries the command line options of parse-geometric.py:
+	# stream, debug, epic, page, source_pdf, layout_template, cache,
+	# write_index and page_jobs.
+	cfg = getConfig(filename)
+	debugMatch = makeDebugMatch(opts.debug, opts.epic, opts.page)
+	geometryMatch = makeGeometryMatch(opts, debugMatch)
+
+	# Debug runs for an EPIC go straight to its boxes, if the file
+	# has a current index
+	if opts.debug and (opts.epic is not None):
+		entries = epicindex.lookup(filename, indexStamp(filename, cfg), opts.epic)
+		if entries is not None:
+			for vInfo in extractBoxes(filename, cfg, entries, opts, debugMatch, geometryMatch):
+				yield vInfo
+			return
+
+	# (epic, page, box) of the records, for the index. Debug runs may
+	# skip pages, so they don't write one.
+	indexEntries = None
+	if opts.write_index and not opts.debug:
+		indexEntries = []
+	# Debug output (and the records kept for annotation) comes from
+	# this process, so debug runs don't spread pages across workers.
+	# Neither do --stream runs, which read the file only once.
+	if (opts.page_jobs > 1) and (not opts.debug) and (opts.source_pdf is None) and (not opts.stream):
+		pages = extractPagesParallel(filename, cfg, opts)
+	else:
+		pages = extractPages(filename, cfg, opts, debugMatch, geometryMatch)
+	for (pageNo, vInfo) in pages:
+		if indexEntries is not None:
+			for info in vInfo:
+				if info.epic:
+					indexEntries.append((info.epic, pageNo, info.box))
+		if len(vInfo)>0:
+			yield vInfo
+	if indexEntries is not None:
+		epicindex.write(filename, indexStamp(filename, cfg), indexEntries)
+
+def extractPages(filename, cfg, opts, debugMatch, geometryMatch):
+	# Yields (pageNo, records) for every page in the file
+	layout = loadLayout(filename, cfg, opts)
+	# For each page, figure out the rects that
+	# contain voter info, then extract data
+	# from each.
+	for (pageNo, thisPage) in iterPages(filename, opts.stream):
+		# Skip pages if debug page filter is active
+		if opts.debug and (opts.page is not None):
+			if pageNo != opts.page:
+				continue
+		runStats.count('pages')
+		rects = computeDataRegions(filename, cfg, thisPage, layout)
+		#print 'Info about %d voters is in page %d'%(len(rects),pageNo)
+		with runStats.timer('assign'):
+			tokens = PageTokens(thisPage)
+		yield (pageNo, getVoterInfo(cfg, tokens, rects, pageNo, debugMatch, geometryMatch))
+	saveLayout(filename, cfg, opts, layout)
+
+def extractPagesParallel(filename, cfg, opts):
+	# Yields (pageNo, records) for every page in the file, like
+	# extractPages, with the pages spread across opts.page_jobs worker
+	# processes. Pages are independent: each has its own TOKENs and
+	# vector file. The byte offset of each PAGE is found here, and a
+	# worker reads and parses only the page it is given. Results come
+	# back in page order.
+	#
+	# Each worker starts from the saved layout template, and sends
+	# back the boxes whenever its template changes. These are merged
+	# into the template here, which is saved at the end.
+	with runStats.timer('parse'):
+		offsets = epicindex.pageOffsets(filename)
+	if not offsets:
+		return
+	layout = loadLayout(filename, cfg, opts)
+	tasks = map(lambda i: (filename, i+1, offsets[i], opts, runStats.enabled), range(len(offsets)))
+	pool = multiprocessing.Pool(min(opts.page_jobs, len(tasks)), initializer=loadConfig)
+	try:
+		for (pageNo, vInfo, rects, pageStats) in pool.imap(extractPageTask, tasks):
+			if rects is not None:
+				layout.update(rects)
+			if pageStats is not None:
+				runStats.merge(stats.fromDict(pageStats))
+			yield (pageNo, vInfo)
+	finally:
+		pool.terminate()
+		pool.join()
+	saveLayout(filename, cfg, opts, layout)
+
+# Layout templates of the files whose pages a worker has processed
+# (see extractPageTask)
+workerLayouts = {}
+
+def extractPageTask(task):
+	# Worker for extractPagesParallel. Returns (pageNo, records,
+	# layout, stats) for one page. layout is the boxes of the worker's
+	# layout template if the page changed it, and stats is None unless
+	# statsEnabled.
+	(filename, pageNo, offset, opts, statsEnabled) = task
+	pageStats = resetStats(statsEnabled)
+	cfg = getConfig(filename)
+	if filename not in workerLayouts:
+		workerLayouts[filename] = loadLayout(filename, cfg, opts)
+	layout = workerLayouts[filename]
+	noDebug = makeDebugMatch(False, None, None)
+	runStats.count('pages')
+	with runStats.timer('parse'):
+		thisPage = ET.fromstring(epicindex.readPage(filename, offset))
+	rects = computeDataRegions(filename, cfg, thisPage, layout)
+	with runStats.timer('assign'):
+		tokens = PageTokens(thisPage)
+	vInfo = getVoterInfo(cfg, tokens, rects, pageNo, noDebug)
+	layoutRects = None
+	if (layout is not None) and layout.changed:
+		layoutRects = layout.rects
+		layout.changed = False
+	if statsEnabled:
+		return (pageNo, vInfo, layoutRects, pageStats.toDict())
+	return (pageNo, vInfo, layoutRects, None)
+
+def indexStamp(filename, cfg):
+	# Stamp of the EPIC index for the file (see epicindex.py)
+	st = os.stat(filename)
+	return cache.cacheKey(['%d'%(st.st_size), repr(st.st_mtime), cache.fileDigest(parserSource)], cfg)
+
+def usesIndex(filename, opts):
+	# True if extractFile goes to the boxes of the EPIC through the
+	# index of the file (a debug run for an EPIC), instead of parsing
+	# the whole file
+	return opts.debug and (opts.epic is not None) and epicindex.isCurrent(filename, indexStamp(filename, getConfig(filename)))
+
+def extractBoxes(filename, cfg, entries, opts, debugMatch, geometryMatch):
+	# Yields the records in the given (page, box, offset) of the file,
+	# parsing only those pages.
+	for (pageNo, box, offset) in sorted(entries):
+		if (opts.page is not None) and (pageNo != opts.page):
+			continue
+		runStats.count('pages')
+		with runStats.timer('parse'):
+			thisPage = ET.fromstring(epicindex.readPage(filename, offset))
+		rects = computeDataRegions(filename, cfg, thisPage)
+		with runStats.timer('assign'):
+			tokens = PageTokens(thisPage)
+			thisRectNodes = tokensInRect(buildTokenIndex(tokens), rects[box])
+		with runStats.timer('extract'):
+			info = extractVoterInfo(cfg, rects[box], tokens, thisRectNodes, pageNo, debugMatch, geometryMatch)
+		if info is not None:
+			info.box = box
+			yield [info]
+
+# The parser source is part of the cache key, so that changes to
+# the parser invalidate the cache
+parserSource = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+def fileCacheKey(filename, cfg):
+	# Key for the result cache. This covers the XML file, the vector
+	# files included by it, the effective config and the parser.
+	(digest, hrefs) = cache.scanInput(filename)
+	digests = [digest, cache.fileDigest(parserSource)]
+	for href in hrefs:
+		path = os.path.join(os.path.dirname(filename), href)
+		if not os.path.isfile(path):
+			# maybe the path in the file is OK
+			path = href
+		digests.append(cache.fileDigest(path))
+	return cache.cacheKey(digests, cfg)
+
+def extractFileCached(filename, opts):
+	# Returns (cached, pages), where pages gives the records a page
+	# at a time, like extractFile.
+	#
+	# If the result cache is enabled (opts.cache) and has the records
+	# for this file, they are taken from there, and cached is True.
+	# Otherwise the file is processed, and the records are added to
+	# the cache once all pages are done. Debug runs, and runs that
+	# annotate the source PDF, don't use the cache, as the cached
+	# records have no coordinates.
+	if (opts.cache is None) or opts.debug or (opts.source_pdf is not None):
+		return (False, extractFile(filename, opts))
+	cfg = getConfig(filename)
+	# The EPIC index is written as the file is processed, so the file
+	# is processed if it has no current index
+	needIndex = opts.write_index and not epicindex.isCurrent(filename, indexStamp(filename, cfg))
+	if opts.layout_template:
+		# Layout templates should not change the records, but keep
+		# them apart from records found without a template
+		cfg['layoutTemplate'] = True
+	key = fileCacheKey(filename, cfg)
+	rows = None
+	if not needIndex:
+		rows = cache.load(opts.cache, filename, key)
+	if rows is not None:
+		runStats.count('cachedFiles')
+		records = map(recordFromRow, rows)
+		return (True, [records])
+	return (False, extractAndStore(filename, opts, key))
+
+def extractAndStore(filename, opts, key):
+	rows = []
+	for vInfo in extractFile(filename, opts):
+		for info in vInfo:
+			rows.append(tuple(map(lambda k: getattr(info, k), fieldOrder)))
+		yield vInfo
+	cache.store(opts.cache, filename, key, rows)
+
+def evictCache(opts):
+	if opts.cache is None:
+		return
+	cache.evict(opts.cache, opts.cache_max_size*1024*1024, opts.cache_max_age*24*3600)
+
+#
+# Output
+#
+
+# Files from the electoral rolls are named AC<ac><booth>
+# e.g. AC1540310 is booth 310 of AC 154. Anything after the booth
+# (e.g. the year in AC1540310-2014) is left out.
+reRollName = re.compile('^AC([0-9]{3})([0-9]{4})($|[^0-9])')
+
+def rollInfo(filename):
+	# Returns (file, ac, booth) for the given file name. AC and
+	# booth are empty if the name does not follow the usual format.
+	name = os.path.basename(filename).replace('.xml','')
+	ob = reRollName.match(name)
+	if ob:
+		return (name, ob.group(1), ob.group(2))
+	return (name, '', '')
+
+# Output formats, and the default output for each
+outputFormats = {
+	'csv' : 'voterlist.csv',
+	'csvz' : 'voterlist.csvz',
+	'sqlite' : 'voterlist.db',
+}
+
+# Write buffer for CSV output
+csvBufferSize = 1024*1024
+
+class CsvOutput(object):
+	# Writes records to a pipe separated file. If merged is set,
+	# records from many files go to the same output, with additional
+	# columns giving the source file, AC and booth.
+	def __init__(self, path, merged=False):
+		self.merged = merged
+		if merged:
+			self.fields = mergedFieldOrder
+		else:
+			self.fields = fieldOrder
+		self.f = codecs.open(path, 'w', 'utf-8', 'strict', csvBufferSize)
+		writeHeader(self.f, sep, self.fields)
+
+	def beginFile(self, filename):
+		self.source = rollInfo(filename)
+
+	def write(self, voterInfo):
+		if self.merged:
+			for info in voterInfo:
+				(info['file'], info['ac'], info['booth']) = self.source
+		writeRecords(self.f, voterInfo, sep, self.fields)
+
+	def endFile(self):
+		pass
+
+	def close(self):
+		self.f.close()
+
+class BlockOutput(object):
+	# Writes the lines of the CSV output to a block compressed file,
+	# with an index by page and EPIC number (see blockfile.py)
+	def __init__(self, path, merged=False):
+		self.merged = merged
+		if merged:
+			self.fields = mergedFieldOrder
+		else:
+			self.fields = fieldOrder
+		self.out = blockfile.BlockWriter(path, self.fields, sep)
+
+	def beginFile(self, filename):
+		self.source = rollInfo(filename)
+
+	def write(self, voterInfo):
+		if self.merged:
+			for info in voterInfo:
+				(info['file'], info['ac'], info['booth']) = self.source
+		lines = formatRecords(voterInfo, sep, self.fields)
+		for i in range(len(lines)):
+			info = voterInfo[i]
+			self.out.add(lines[i], (self.source[0], info['page']), info['epic'])
+
+	def endFile(self):
+		pass
+
+	def close(self):
+		self.out.close()
+
+class SqliteOutput(object):
+	# Writes records to a SQLite database (see voterdb.py). Each file
+	# is loaded in a single transaction, replacing any records loaded
+	# earlier from the same file.
+	def __init__(self, path, merged=False):
+		self.conn = voterdb.connect(path)
+
+	def beginFile(self, filename):
+		self.source = rollInfo(filename)
+		voterdb.deleteFile(self.conn, self.source[0])
+
+	def write(self, voterInfo):
+		for info in voterInfo:
+			(info['file'], info['ac'], info['booth']) = self.source
+		voterdb.insertRecords(self.conn, voterInfo)
+
+	def endFile(self):
+		self.conn.commit()
+
+	def close(self):
+		# Anything not committed by endFile is rolled back
+		self.conn.close()
+
+def openOutput(format, path, merged=False):
+	if format == 'sqlite':
+		return SqliteOutput(path, merged)
+	if format == 'csvz':
+		return BlockOutput(path, merged)
+	return CsvOutput(path, merged)
+
+#
+# Stats
+#
+
+def statsWanted(opts):
+	return opts.stats or (opts.stats_json is not None)
+
+def reportStats(opts, total, perFile):
+	# Print the stats table (--stats) and/or write them out as JSON
+	# (--stats-json), with the stats of each file in perFile.
+	if opts.stats:
+		print 'Stats:'
+		stats.report(total, sys.stdout)
+	if opts.stats_json is not None:
+		f = open(opts.stats_json, 'w')
+		json.dump({'total' : total.toDict(), 'files' : perFile}, f, indent=2, sort_keys=True)
+		f.close()
+
+#
+# Batch processing
+#
+
+def findInputs(paths):
+	# Expand directories and glob patterns into a sorted list of
+	# XML files. Plain file names are taken as they are.
+	filenames = []
+	for path in paths:
+		if os.path.isdir(path):
+			filenames.extend(sorted(glob.glob(os.path.join(path, '*.xml'))))
+		elif glob.has_magic(path):
+			filenames.extend(sorted(glob.glob(path)))
+		else:
+			filenames.append(path)
+	return filenames
+
+def batchOutputName(filename, outputDir, format):
+	name = os.path.basename(filename).replace('.xml','')
+	ext = os.path.splitext(outputFormats[format])[1]
+	return os.path.join(outputDir, name + ext)
+
+def processBatchFile(task):
+	# Worker for batch processing. Processes one file, and either
+	# writes the records to its own output file, or returns them
+	# for merging (if output is None).
+	#
+	# Errors are caught and returned, so that one bad file does not
+	# stop the batch.
+	(filename, output, opts) = task
+	records = []
+	count = 0
+	out = None
+	fileStats = resetStats(statsWanted(opts))
+	try:
+		if output is not None:
+			out = openOutput(opts.format, output)
+			out.beginFile(filename)
+		(cached, pages) = extractFileCached(filename, opts)
+		for vInfo in pages:
+			count = count + len(vInfo)
+			if out is not None:
+				with fileStats.timer('write'):
+					out.write(vInfo)
+				continue
+			for info in vInfo:
+				info.debug = None
+			records.extend(vInfo)
+		if out is not None:
+			out.endFile()
+			out.close()
+	except Exception:
+		error = traceback.format_exc()
+		# Don't leave a partial output behind
+		if out is not None:
+			out.close()
+			os.remove(output)
+		return (filename, output, 0, None, False, None, error)
+	if fileStats.enabled:
+		return (filename, output, count, records, cached, fileStats.toDict(), None)
+	return (filename, output, count, records, cached, None, None)
+
+def processBatch(filenames, outputDir, output, jobs, opts):
+	# Process many files across a pool of 'jobs' worker processes.
+	#
+	# If outputDir is given, every file is written to its own output
+	# file in outputDir. Otherwise all records are merged into
+	# 'output', with columns giving the source file, AC and booth.
+	# opts.format gives the format of the output.
+	#
+	# Returns the list of (filename, error) for files that failed.
+	if outputDir is not None:
+		if not os.path.isdir(outputDir):
+			os.makedirs(outputDir)
+		tasks = map(lambda fn: (fn, batchOutputName(fn, outputDir, opts.format), opts), filenames)
+		merged = None
+	else:
+		tasks = map(lambda fn: (fn, None, opts), filenames)
+		merged = openOutput(opts.format, output, merged=True)
+
+	pool = None
+	if jobs > 1:
+		pool = multiprocessing.Pool(jobs, initializer=loadConfig)
+		results = pool.imap(processBatchFile, tasks)
+	else:
+		results = itertools.imap(processBatchFile, tasks)
+
+	failed = []
+	totalRecords = 0
+	totalStats = stats.Stats()
+	perFile = {}
+	for (filename, fileOutput, count, records, cached, fileStats, error) in results:
+		if error is not None:
+			print '%s => FAILED'%(filename)
+			failed.append((filename, error))
+			continue
+		if fileStats is not None:
+			perFile[filename] = fileStats
+			totalStats.merge(stats.fromDict(fileStats))
+			totalStats.count('files')
+		if merged is not None:
+			start = time.time()
+			merged.beginFile(filename)
+			merged.write(records)
+			merged.endFile()
+			totalStats.addSince('write', start)
+			fileOutput = output
+		if cached:
+			print '%s => %s : %d records (cached).'%(filename, fileOutput, count)
+		else:
+			print '%s => %s : %d records.'%(filename, fileOutput, count)
+		sys.stdout.flush()
+		totalRecords = totalRecords + count
+
+	if pool is not None:
+		pool.close()
+		pool.join()
+	if merged is not None:
+		merged.close()
+
+	print 'Processed %d files, %d failed. Total %d records.'%(len(filenames), len(failed), totalRecords)
+	if failed:
+		print 'Failed files:'
+		for (filename, error) in failed:
+			print '  %s'%(filename)
+			print '    ' + error.strip().split('\n')[-1]
+	if statsWanted(opts):
+		reportStats(opts, totalStats, perFile)
+	return failed
+
@@ -6,48 +6,45 @@ Tested to get voter lists for Rajarajeshwari Nagar area, which in turn comes und
 
 Tested as :
 ./get_voterlists.py 154 338 338
+
+Files are fetched in parallel (see -j), and interrupted downloads are
+resumed on the next run.
 """
 import sys
 import os
 import os.path
-import subprocess
-
-areaCode = int(sys.argv[1])
-minIdx = int(sys.argv[2])
-maxIdx = int(sys.argv[3])
-
-# ceokarnataka.kar.nic.in has voter lists inside a specific directory.
-# we can get voter lists with a simple get on the URL
-# e.g. http://ceokarnataka.kar.nic.in/ElectionFinalroll2014/PCROLL_2014/English/WOIMG/AC154/AC1540347.pdf
-# here : AC154 -> this is the number for your area
-# (eductaed guess is that AC possibly stands for "assembly constituency")
-#
-urlFmt = 'http://ceokarnataka.kar.nic.in/ElectionFinalroll2014/PCROLL_2014/English/WOIMG/AC%03d/AC%03d%04d.pdf'
-
-def getUrl(url, outdir, retries=10):
-	# Retry to get URL. CEO karnataka website may not accept connections, especially on election day!
-	fname = os.path.join(outdir, url.split('/')[-1])
-	if os.path.isfile(fname):
-		print 'File %s exists. Not getting from web'%(url)
-		return
-	print 'Retrieving URL %s... '%(url)
-	for retry in range(retries):
-		ret = subprocess.call(['wget', url, '-O' , fname])
-		if ret == 0:
-			return
-		print '  Try %d(of %d)'%(retry+2, retries)
-	print >> sys.stderr, "Failed to get file. Exiting..."
-	sys.exit(1)
+import argparse
+
+from downloader import fetchAll, urlFmt
+
+parser = argparse.ArgumentParser()
+parser.add_argument("areaCode", type=int, help="AC number")
+parser.add_argument("minIdx", type=int, help="First booth number")
+parser.add_argument("maxIdx", type=int, help="Last booth number")
+parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of files to download in parallel, defaults to 4")
+parser.add_argument("--interval", type=float, default=0.5, help="Minimum time (in seconds) between requests to the server, defaults to 0.5")
+parser.add_argument("--retries", type=int, default=10, help="Number of tries for each file, defaults to 10")
+parser.add_argument("--url-format", type=str, default=urlFmt, help="Format of the URL for a booth. Takes the AC number twice, and then the booth number.")
+parser.add_argument("--outdir", type=str, default='ceo-files', help="Directory to save the files in, defaults to ceo-files")
+args = parser.parse_args()
 
 # Create the ceo-files directory, if it doesn't exist
-srcDir = 'ceo-files'
+srcDir = args.outdir
 try:
 	os.mkdir(srcDir)
 except OSError:
 	pass
 
-# Get all the files in a loop
-for boothNo in range(minIdx, maxIdx+1):
-	print 'Retrieving voter list for booth %d'%(boothNo)
-	url = urlFmt%(areaCode, areaCode, boothNo)
-	getUrl(url, srcDir)
+# Get all the files.
+# Retry to get URLs. CEO karnataka website may not accept connections, especially on election day!
+items = []
+for boothNo in range(args.minIdx, args.maxIdx+1):
+	url = args.url_format%(args.areaCode, args.areaCode, boothNo)
+	items.append((url, os.path.join(srcDir, url.split('/')[-1])))
+
+failed = fetchAll(items, workers=args.jobs, interval=args.interval, retries=args.retries)
+if failed:
+	print >> sys.stderr, "Failed to get %d file(s):"%(len(failed))
+	for url in failed:
+		print >> sys.stderr, "  %s"%(url)
+	sys.exit(1)
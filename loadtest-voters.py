@@ -0,0 +1,111 @@
+#!/usr/bin/python
+"""
+Load test for serve-voters.py. Queries for EPIC numbers, name prefixes
+and booths are made up from records in the given sources (the same
+ones the server was started with), and sent to the server from a
+number of client threads, each with its own connection. Reports the
+throughput, and the latency of requests at the 50th, 90th and 99th
+percentiles.
+
+e.g.
+  ./serve-voters.py csv/ &
+  ./loadtest-voters.py --clients 8 --requests 20000 csv/
+"""
+import itertools
+import threading
+import argparse
+import urlparse
+import httplib
+import urllib
+import random
+import time
+import sys
+
+import voterindex
+
+fields = voterindex.fields
+fieldPos = dict(map(lambda i: (fields[i], i), range(len(fields))))
+
+def makeQueries(sources, sample, distinct):
+	# Returns 'distinct' query paths, from the first 'sample' records
+	# of the sources
+	records = list(itertools.islice(itertools.chain.from_iterable(
+		itertools.imap(voterindex.readSource, voterindex.findSources(sources))), sample))
+	if not records:
+		raise IOError('No records in %s'%(', '.join(sources)))
+	queries = set()
+	for i in range(distinct*10):
+		if len(queries) >= distinct:
+			break
+		rec = random.choice(records)
+		kind = random.random()
+		if kind < 0.6 and rec[fieldPos['epic']]:
+			queries.add('/epic?' + urllib.urlencode({'id' : rec[fieldPos['epic']].encode('utf-8')}))
+		elif kind < 0.9 and voterindex.normalize(rec[fieldPos['name']]):
+			name = voterindex.normalize(rec[fieldPos['name']])
+			queries.add('/name?' + urllib.urlencode({'prefix' : name[:random.randint(3, 6)].encode('utf-8'), 'limit' : 20}))
+		else:
+			queries.add('/booth?' + urllib.urlencode({'file' : rec[fieldPos['file']].encode('utf-8')}))
+	return list(queries)
+
+def client(host, port, queries, count, latencies, errors):
+	conn = httplib.HTTPConnection(host, port)
+	for i in range(count):
+		path = random.choice(queries)
+		start = time.time()
+		try:
+			conn.request('GET', path)
+			response = conn.getresponse()
+			response.read()
+			if response.status != 200:
+				errors.append('%s : %d'%(path, response.status))
+		except (httplib.HTTPException, IOError) as e:
+			errors.append('%s : %s'%(path, e))
+			conn.close()
+			conn = httplib.HTTPConnection(host, port)
+			continue
+		latencies.append(time.time() - start)
+	conn.close()
+
+def percentile(values, p):
+	# values are sorted
+	return values[int(round(p*(len(values)-1)))]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("sources", type=str, nargs='+', help="Sources to make up queries from: CSV files, csvz files or SQLite databases, or directories containing them")
+	parser.add_argument("--url", type=str, default='http://127.0.0.1:8000/', help="URL of the server, defaults to http://127.0.0.1:8000/")
+	parser.add_argument("--clients", type=int, default=8, help="Number of clients sending requests at the same time, defaults to 8")
+	parser.add_argument("--requests", type=int, default=10000, help="Total number of requests, defaults to 10000")
+	parser.add_argument("--distinct", type=int, default=1000, help="Number of different queries, defaults to 1000. Fewer queries mean more answers come from the cache.")
+	parser.add_argument("--sample", type=int, default=100000, help="Make up queries from the first this many records of the sources, defaults to 100000")
+	args = parser.parse_args()
+
+	url = urlparse.urlparse(args.url)
+	queries = makeQueries(args.sources, args.sample, args.distinct)
+
+	latencies = []
+	errors = []
+	threads = []
+	perClient = args.requests // args.clients
+	start = time.time()
+	for i in range(args.clients):
+		t = threading.Thread(target=client, args=(url.hostname, url.port or 80, queries, perClient, latencies, errors))
+		t.daemon = True
+		t.start()
+		threads.append(t)
+	for t in threads:
+		while t.isAlive():
+			t.join(0.5)
+	elapsed = time.time() - start
+
+	latencies.sort()
+	print '%d requests (%d queries) from %d clients in %.2f secs: %.0f requests/sec, %d errors.'%(
+		len(latencies) + len(errors), len(queries), args.clients, elapsed, (len(latencies) + len(errors))/elapsed, len(errors))
+	if latencies:
+		print 'Latency (ms): p50 %.2f, p90 %.2f, p99 %.2f, max %.2f'%tuple(map(lambda v: v*1000,
+			[percentile(latencies, 0.5), percentile(latencies, 0.9), percentile(latencies, 0.99), latencies[-1]]))
+	for error in errors[:10]:
+		print >> sys.stderr, error
+	if errors:
+		sys.exit(1)
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+"""
+Generate a synthetic voter list in pdftoxml format, for benchmarks
+and for trying out the parser without real electoral rolls.
+
+e.g.
+  ./make-synthetic-roll.py --pages 300 synthetic/SYN0001.xml
+  ./parse-geometric.py synthetic/SYN0001.xml
+"""
+import argparse
+import os
+
+import synthetic
+
+d = synthetic.defaults
+parser = argparse.ArgumentParser()
+parser.add_argument("filename", type=str, help="XML file to write. Vector files go into <filename>_data")
+parser.add_argument("--pages", type=int, default=d['pages'], help="Number of pages, defaults to %d"%(d['pages']))
+parser.add_argument("--rows", type=int, default=d['rows'], help="Rows of voter boxes in a page, defaults to %d"%(d['rows']))
+parser.add_argument("--cols", type=int, default=d['cols'], help="Columns of voter boxes in a page, defaults to %d"%(d['cols']))
+parser.add_argument("--box-width", type=float, default=d['boxWidth'], help="Width of a voter box in points, defaults to %.0f"%(d['boxWidth']))
+parser.add_argument("--box-height", type=float, default=d['boxHeight'], help="Height of a voter box in points, defaults to %.0f"%(d['boxHeight']))
+parser.add_argument("--line-ratio", type=float, default=d['lineRatio'], help="Fraction of boxes drawn as separate lines instead of rectangles, defaults to %.1f"%(d['lineRatio']))
+parser.add_argument("--noise", type=int, default=d['noise'], help="Number of decorative shapes per page, defaults to %d"%(d['noise']))
+parser.add_argument("--jitter", type=float, default=d['jitter'], help="Random displacement of coordinates in points, defaults to %.1f"%(d['jitter']))
+parser.add_argument("--missing-epic", type=float, default=d['missingEpic'], help="Fraction of records without an EPIC number, defaults to %.2f"%(d['missingEpic']))
+parser.add_argument("--seed", type=int, default=d['seed'], help="Random seed, defaults to %d"%(d['seed']))
+args = parser.parse_args()
+
+outDir = os.path.dirname(args.filename)
+if outDir and not os.path.isdir(outDir):
+	os.makedirs(outDir)
+
+count = synthetic.generate(args.filename, {
+	'pages' : args.pages,
+	'rows' : args.rows,
+	'cols' : args.cols,
+	'boxWidth' : args.box_width,
+	'boxHeight' : args.box_height,
+	'lineRatio' : args.line_ratio,
+	'noise' : args.noise,
+	'jitter' : args.jitter,
+	'missingEpic' : args.missing_epic,
+	'seed' : args.seed,
+})
+print '%s : %d pages, %d voter boxes.'%(args.filename, args.pages, count)
@@ -0,0 +1,75 @@
+"""
+Decompresses the FlateDecode streams of a PDF file, in memory.
+
+The voter lists from ceokarnataka.kar.nic.in have their page content in
+FlateDecode (zlib) streams. convert.sh runs Ghostscript (pdfinflt.ps)
+on every file to write out a copy with these streams decompressed, so
+that extract-voter-info.py can find the text in it. This does the same
+with zlib, without starting Ghostscript, and without writing the copy
+to disk.
+
+Only what extract-voter-info.py needs is done: the decompressed data of
+each stream is given out, in the order of the streams in the file.
+Streams that are not FlateDecode are given out as they are.
+"""
+import zlib
+import re
+
+# The dictionary of a stream object ends just before the 'stream'
+# keyword, which is followed by an end of line.
+reStreamStart = re.compile('>>\\s*stream(\r\n|\n|\r)')
+reLength = re.compile('/Length\\s+([0-9]+)(\\s+[0-9]+\\s+R)?')
+
+def streams(data):
+	# Yields (dictionary, raw data) for every stream in the PDF data
+	pos = 0
+	while True:
+		ob = reStreamStart.search(data, pos)
+		if ob is None:
+			return
+		start = ob.end()
+		objStart = data.rfind(' obj', 0, ob.start())
+		if objStart < 0:
+			objStart = 0
+		header = data[objStart:ob.start()+2]
+
+		# Take the length from the dictionary if it is given there,
+		# and not as a reference to another object. Otherwise look
+		# for the end of the stream.
+		end = -1
+		lm = reLength.search(header)
+		if lm and not lm.group(2):
+			end = start + int(lm.group(1))
+			if data[end:end+40].lstrip().startswith('endstream'):
+				pos = end
+			else:
+				end = -1
+		if end < 0:
+			end = data.find('endstream', start)
+			if end < 0:
+				return
+			pos = end
+		yield (header, data[start:end])
+
+def inflate(data):
+	# Yields the content of each stream in the PDF data, with
+	# FlateDecode streams decompressed. A stream that can't be
+	# decompressed (e.g. it is damaged) is skipped.
+	for (header, raw) in streams(data):
+		if '/FlateDecode' not in header:
+			yield raw
+			continue
+		try:
+			# A decompressor object ignores anything after the end
+			# of the compressed data, e.g. an end of line
+			yield zlib.decompressobj().decompress(raw)
+		except zlib.error:
+			continue
+
+def inflateFile(filename):
+	f = open(filename, 'rb')
+	try:
+		data = f.read()
+	finally:
+		f.close()
+	return inflate(data)
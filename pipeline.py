@@ -0,0 +1,247 @@
+"""
+Runs the download, convert and parse steps for voter lists as one
+pipeline, so that files move on to the next step as soon as they are
+ready: the network is busy while files are being parsed, and the CPUs
+are busy while the rest are being downloaded.
+
+Each stage is a pool of worker threads, taking files from its input
+queue and putting the result on the queue of the next stage. Queues
+are bounded, so a stage that runs ahead of the next one waits for it,
+instead of piling up files.
+
+  download : downloader.fetch, to <pdfDir>/<name>.pdf
+  convert  : pdftoxml, to <xmlDir>/<name>.xml. The command is given as
+             a template, so that it can be replaced (e.g. by a stub in
+             tests, or by pdftoxml.exe on Windows). The XML is put in
+             place only once it is complete.
+  parse    : processBatchFile from geometric.py, to <outputDir>. Parsing
+             is CPU bound, so the parse threads hand their files to a
+             pool of worker processes.
+
+A file that fails at some stage is reported, and does not go on to the
+later stages. Files that are already downloaded or converted are not
+done again.
+"""
+import multiprocessing
+import subprocess
+import threading
+import traceback
+import shutil
+import shlex
+import Queue
+import time
+import sys
+import os
+
+import downloader
+import geometric
+
+# Default command to convert a PDF to XML. %(pdf)s and %(xml)s are
+# replaced by the input and output file names.
+pdftoxmlCommand = 'pdftoxml %(pdf)s %(xml)s'
+
+class StageError(Exception):
+	pass
+
+# Put on a queue to tell the workers of the stage that there is no
+# more work
+endOfWork = object()
+
+class Stage(object):
+	# A pool of worker threads, applying func to each item from
+	# inQueue, and putting the result on outQueue (if any).
+	def __init__(self, name, func, workers, inQueue, outQueue, failed):
+		self.name = name
+		self.func = func
+		self.workers = workers
+		self.inQueue = inQueue
+		self.outQueue = outQueue
+		self.failed = failed
+		self.lock = threading.Lock()
+		self.running = workers
+		self.done = 0
+		self.busy = 0.0
+		self.threads = []
+
+	def start(self, nextStage):
+		self.nextStage = nextStage
+		for i in range(self.workers):
+			t = threading.Thread(target=self.work, name='%s-%d'%(self.name, i))
+			t.daemon = True
+			t.start()
+			self.threads.append(t)
+
+	def work(self):
+		while True:
+			item = self.inQueue.get()
+			if item is endOfWork:
+				break
+			(key, value) = item
+			start = time.time()
+			try:
+				result = self.func(value)
+				ok = True
+			except Exception as e:
+				if isinstance(e, StageError):
+					error = str(e)
+				else:
+					error = traceback.format_exc().strip().split('\n')[-1]
+				ok = False
+			self.lock.acquire()
+			try:
+				self.busy = self.busy + (time.time() - start)
+				if ok:
+					self.done = self.done + 1
+				else:
+					self.failed.append((key, self.name, error))
+			finally:
+				self.lock.release()
+			if ok:
+				downloader.log('%s : %s done'%(key, self.name))
+				if self.outQueue is not None:
+					# Waits here if the next stage is behind
+					self.outQueue.put((key, result))
+			else:
+				downloader.log('%s : %s FAILED : %s'%(key, self.name, error))
+
+		# The last worker out tells the next stage that there is no
+		# more work coming
+		self.lock.acquire()
+		try:
+			self.running = self.running - 1
+			last = (self.running == 0)
+		finally:
+			self.lock.release()
+		if last and (self.nextStage is not None):
+			for i in range(self.nextStage.workers):
+				self.outQueue.put(endOfWork)
+
+	def join(self):
+		# Join with a timeout, so that Ctrl-C gets through
+		for t in self.threads:
+			while t.isAlive():
+				t.join(0.5)
+
+def run(items, stages, queueSize=4):
+	# Run items through the stages, given as a list of
+	# (name, func, workers). Items are (key, value), where key names
+	# the item in messages. Returns (stages, results, failed), with
+	# the results of the last stage as (key, value), and failed as
+	# (key, stage name, error).
+	failed = []
+	results = []
+	queues = map(lambda s: Queue.Queue(queueSize), stages)
+	# The last stage puts its results on an unbounded queue, which
+	# is drained at the end
+	queues.append(Queue.Queue())
+	running = []
+	for (i, (name, func, workers)) in enumerate(stages):
+		running.append(Stage(name, func, workers, queues[i], queues[i+1], failed))
+	for i in range(len(running)):
+		nextStage = None
+		if i+1 < len(running):
+			nextStage = running[i+1]
+		running[i].start(nextStage)
+
+	for item in items:
+		queues[0].put(item)
+	for i in range(running[0].workers):
+		queues[0].put(endOfWork)
+	for stage in running:
+		stage.join()
+
+	while not queues[-1].empty():
+		results.append(queues[-1].get())
+	return (running, results, failed)
+
+#
+# The stages for voter lists
+#
+
+def downloadStage(limiter, retries):
+	def download((url, pdfName)):
+		if not downloader.fetch(url, pdfName, limiter, retries=retries):
+			raise StageError('could not download %s'%(url))
+		return pdfName
+	return download
+
+def convertStage(xmlDir, command):
+	# pdftoxml writes the XML, and the vector files in <xml>_data, as
+	# it goes. It is run into a directory of its own, and what it made
+	# is moved to xmlDir when it is done, the XML last. An XML file in
+	# xmlDir is then always complete, and a conversion that was cut
+	# short is done again.
+	def convert(pdfName):
+		name = os.path.basename(pdfName).replace('.pdf', '.xml')
+		xmlName = os.path.join(xmlDir, name)
+		if os.path.isfile(xmlName) and os.path.getmtime(xmlName) >= os.path.getmtime(pdfName):
+			return xmlName
+		workDir = xmlName + '.converting'
+		if os.path.exists(workDir):
+			shutil.rmtree(workDir)
+		os.makedirs(workDir)
+		try:
+			tmpName = os.path.join(workDir, name)
+			args = map(lambda a: a%{'pdf' : pdfName, 'xml' : tmpName}, shlex.split(command))
+			status = subprocess.call(args)
+			# pdftoxml does not return 0 on success, so check for the
+			# output instead
+			if not os.path.isfile(tmpName):
+				raise StageError('%s gave no output (exit status %d)'%(args[0], status))
+			# The XML refers to the vector files by a path relative to
+			# it, so they move together
+			if os.path.exists(xmlName):
+				os.remove(xmlName)
+			if os.path.exists(xmlName + '_data'):
+				shutil.rmtree(xmlName + '_data')
+			if os.path.exists(tmpName + '_data'):
+				os.rename(tmpName + '_data', xmlName + '_data')
+			os.rename(tmpName, xmlName)
+		finally:
+			shutil.rmtree(workDir, True)
+		return xmlName
+	return convert
+
+def parseStage(pool, outputDir, opts):
+	def parse(xmlName):
+		output = geometric.batchOutputName(xmlName, outputDir, opts.format)
+		(filename, output, count, records, cached, fileStats, error) = pool.apply(geometric.processBatchFile, ((xmlName, output, opts),))
+		if error is not None:
+			raise StageError(error.strip().split('\n')[-1])
+		return (output, count)
+	return parse
+
+def runVoterLists(items, pdfDir, xmlDir, outputDir, opts, downloadJobs=4, convertJobs=2,
+	parseJobs=2, interval=0.5, retries=10, command=pdftoxmlCommand, queueSize=4):
+	# Download, convert and parse the files given as (url, name) in
+	# items. 'opts' are the options for processBatchFile, as
+	# parse-geometric.py would give them.
+	#
+	# Returns (stages, results, failed) as run() does.
+	for d in [pdfDir, xmlDir, outputDir]:
+		if not os.path.isdir(d):
+			os.makedirs(d)
+	limiter = downloader.RateLimiter(interval)
+	pool = multiprocessing.Pool(parseJobs, initializer=geometric.loadConfig)
+	try:
+		stages = [
+			('download', downloadStage(limiter, retries), downloadJobs),
+			('convert', convertStage(xmlDir, command), convertJobs),
+			('parse', parseStage(pool, outputDir, opts), parseJobs),
+		]
+		items = map(lambda (url, name): (name, (url, os.path.join(pdfDir, name + '.pdf'))), items)
+		return run(items, stages, queueSize)
+	finally:
+		pool.close()
+		pool.join()
+
+def report(stages, results, failed, f=sys.stdout):
+	print >>f, '  %-10s %6s %6s %10s'%('stage', 'done', 'failed', 'busy secs')
+	for stage in stages:
+		nFailed = len(filter(lambda x: x[1] == stage.name, failed))
+		print >>f, '  %-10s %6d %6d %10.1f'%(stage.name, stage.done, nFailed, stage.busy)
+	print >>f, 'Total %d records in %d files.'%(sum(map(lambda (key, (output, count)): count, results)), len(results))
+	if failed:
+		print >>f, 'Failed files:'
+		for (key, stageName, error) in sorted(failed):
+			print >>f, '  %s (%s) : %s'%(key, stageName, error)
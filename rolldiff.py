@@ -0,0 +1,170 @@
+"""
+Differences between two revisions of a roll, as parsed by
+parse-geometric.py.
+
+Records of the two revisions are matched on EPIC number. Records
+without an EPIC number (extractVoterInfo allows this) are matched on
+(ac, booth, page, serial) instead, so that revisions written to files
+of different names (e.g. AC1540310.xml and AC1540310-2014.xml) still
+match. Only if the file name gives no AC and booth is the file name
+used in their place. Matched records whose fields differ are
+reported as changed, with the fields that changed. Unmatched records
+are reported as added or removed.
+
+This is a hash join: the records of the old revision are put in a
+table, and those of the new revision are looked up in it as they are
+read. The new revision is never held in memory. If the old revision
+has more than maxRecords records, both revisions are first split into
+partitions on disk by a hash of the key, and the partitions are joined
+one at a time. Partitions that are still too large are split again.
+
+Output is written as it is found, one line per record:
+
+  + <record>                       added
+  - <record>                       removed
+  ~ <key> : <field> 'old' => 'new', ...   changed
+
+with records in the field order of voterdb.fields, separated by '|'.
+"""
+import itertools
+import tempfile
+import marshal
+import shutil
+import os
+
+import voterdb
+from geometric import sep
+
+fields = voterdb.fields
+fieldPos = dict(map(lambda i: (fields[i], i), range(len(fields))))
+# Fields compared for changes. The file name is left out, so that
+# revisions written to files of different names can be compared; a
+# change of booth shows up in the AC and booth fields.
+comparedPos = map(lambda f: fieldPos[f], filter(lambda f: f != 'file', fields))
+
+# Partitions made at each level of splitting
+fanout = 16
+# Levels of splitting, after which a partition is joined in memory
+# whatever its size (e.g. if it is all one key)
+maxDepth = 4
+
+def recordKey(rec):
+	epic = rec[fieldPos['epic']]
+	if epic:
+		return ('E', epic)
+	if rec[fieldPos['ac']]:
+		return ('P', rec[fieldPos['ac']], rec[fieldPos['booth']], rec[fieldPos['page']], rec[fieldPos['serial']])
+	return ('F', rec[fieldPos['file']], rec[fieldPos['page']], rec[fieldPos['serial']])
+
+def formatKey(key):
+	if key[0] == 'E':
+		return key[1]
+	if key[0] == 'P':
+		return 'AC %s booth %s page %s serial %s'%(key[1], key[2], key[3], key[4])
+	return '%s page %s serial %s'%(key[1], key[2], key[3])
+
+class DiffWriter(object):
+	# Writes out the differences, and counts them
+	def __init__(self, f):
+		self.f = f
+		self.added = 0
+		self.removed = 0
+		self.changed = 0
+		self.unchanged = 0
+
+	def add(self, rec):
+		self.added = self.added + 1
+		self.f.write(u'+ %s\n'%(sep.join(rec)))
+
+	def remove(self, rec):
+		self.removed = self.removed + 1
+		self.f.write(u'- %s\n'%(sep.join(rec)))
+
+	def compare(self, key, old, new):
+		changes = []
+		for i in comparedPos:
+			if old[i] != new[i]:
+				changes.append(u"%s '%s' => '%s'"%(fields[i], old[i], new[i]))
+		if not changes:
+			self.unchanged = self.unchanged + 1
+			return
+		self.changed = self.changed + 1
+		self.f.write(u'~ %s : %s\n'%(formatKey(key), ', '.join(changes)))
+
+def joinInMemory(old, new, writer):
+	# Join with the old records in a table. Records with the same key
+	# (e.g. an EPIC that appears twice) are matched in order.
+	table = {}
+	for rec in old:
+		table.setdefault(recordKey(rec), []).append(rec)
+	for rec in new:
+		key = recordKey(rec)
+		matches = table.get(key)
+		if not matches:
+			writer.add(rec)
+			continue
+		writer.compare(key, matches.pop(0), rec)
+		if not matches:
+			del table[key]
+	for key in sorted(table.keys()):
+		for rec in table[key]:
+			writer.remove(rec)
+
+def spill(records, tmpDir, prefix, depth):
+	# Write records to 'fanout' partition files by hash of their key.
+	# Returns the paths, and the number of records in each.
+	paths = map(lambda i: os.path.join(tmpDir, '%s-%d-%d'%(prefix, depth, i)), range(fanout))
+	files = map(lambda p: open(p, 'wb'), paths)
+	counts = [0]*fanout
+	try:
+		for rec in records:
+			# The depth changes the hash, so that a partition that is
+			# split again does not land in one partition
+			i = hash((depth, recordKey(rec))) % fanout
+			marshal.dump(rec, files[i])
+			counts[i] = counts[i] + 1
+	finally:
+		for f in files:
+			f.close()
+	return (paths, counts)
+
+def readSpilled(path):
+	f = open(path, 'rb')
+	try:
+		while True:
+			try:
+				yield marshal.load(f)
+			except EOFError:
+				return
+	finally:
+		f.close()
+
+def joinPartitioned(old, new, writer, maxRecords, tmpDir, depth):
+	(oldPaths, oldCounts) = spill(old, tmpDir, 'old', depth)
+	(newPaths, newCounts) = spill(new, tmpDir, 'new', depth)
+	for i in range(fanout):
+		if (oldCounts[i] > maxRecords) and (depth+1 < maxDepth):
+			subDir = tempfile.mkdtemp(dir=tmpDir)
+			joinPartitioned(readSpilled(oldPaths[i]), readSpilled(newPaths[i]), writer, maxRecords, subDir, depth+1)
+			shutil.rmtree(subDir)
+		else:
+			joinInMemory(readSpilled(oldPaths[i]), readSpilled(newPaths[i]), writer)
+		os.remove(oldPaths[i])
+		os.remove(newPaths[i])
+
+def diff(old, new, f, maxRecords=1000000, tmpDir=None):
+	# Write the differences between the records in old and new (as
+	# tuples in the order of voterdb.fields) to f. Returns the
+	# DiffWriter, with the counts.
+	writer = DiffWriter(f)
+	old = iter(old)
+	head = list(itertools.islice(old, maxRecords+1))
+	if len(head) <= maxRecords:
+		joinInMemory(head, new, writer)
+		return writer
+	spillDir = tempfile.mkdtemp(prefix='rolldiff-', dir=tmpDir)
+	try:
+		joinPartitioned(itertools.chain(head, old), new, writer, maxRecords, spillDir, 0)
+	finally:
+		shutil.rmtree(spillDir)
+	return writer
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+"""
+Download, convert and parse the voter lists of a range of booths, as
+one pipeline (see pipeline.py). This does what get-voterlists.py,
+pdftoxml and parse-geometric.py --output-dir do one after the other,
+but files move to the next step as soon as they are ready.
+
+e.g.
+  ./run-pipeline.py 154 310 348
+  ./run-pipeline.py --pdftoxml "pdftoxml.exe %(pdf)s %(xml)s" 154 310 348
+"""
+import multiprocessing
+import argparse
+import sys
+
+import pipeline
+from downloader import urlFmt
+from geometric import outputFormats
+
+if __name__ == '__main__':
+	cpus = multiprocessing.cpu_count()
+	parser = argparse.ArgumentParser()
+	parser.add_argument("areaCode", type=int, help="AC number")
+	parser.add_argument("minIdx", type=int, help="First booth number")
+	parser.add_argument("maxIdx", type=int, help="Last booth number")
+	parser.add_argument("--url-format", type=str, default=urlFmt, help="Format of the URL for a booth. Takes the AC number twice, and then the booth number.")
+	parser.add_argument("--pdf-dir", type=str, default='ceo-files', help="Directory for the downloaded PDF files, defaults to ceo-files")
+	parser.add_argument("--xml-dir", type=str, default='converted', help="Directory for the converted XML files, defaults to converted")
+	parser.add_argument("--output-dir", type=str, default='csv', help="Directory for the records of each file, defaults to csv")
+	parser.add_argument("--format", type=str, choices=sorted(outputFormats.keys()), default='csv', help="Output format, as for parse-geometric.py")
+	parser.add_argument("--pdftoxml", type=str, default=pipeline.pdftoxmlCommand, help="Command to convert a PDF file to XML. %%(pdf)s and %%(xml)s are replaced by the file names. Defaults to '%s'"%(pipeline.pdftoxmlCommand.replace('%', '%%')))
+	parser.add_argument("--download-jobs", type=int, default=4, help="Number of files to download in parallel, defaults to 4")
+	parser.add_argument("--convert-jobs", type=int, default=cpus, help="Number of files to convert in parallel. Defaults to the number of CPUs.")
+	parser.add_argument("--parse-jobs", type=int, default=cpus, help="Number of files to parse in parallel. Defaults to the number of CPUs.")
+	parser.add_argument("--queue-size", type=int, default=4, help="Number of files that can wait between two steps, defaults to 4. A step that gets this far ahead of the next one waits for it.")
+	parser.add_argument("--interval", type=float, default=0.5, help="Minimum time (in seconds) between requests to the server, defaults to 0.5")
+	parser.add_argument("--retries", type=int, default=10, help="Number of tries for each file, defaults to 10")
+	parser.add_argument("--stream", help="Parse the documents a page at a time, as for parse-geometric.py", action="store_true")
+	parser.add_argument("--layout-template", help="Reuse the voter boxes found on a page for later pages, as for parse-geometric.py", action="store_true")
+	parser.add_argument("--cache", type=str, help="Cache the records from each file in this directory, as for parse-geometric.py")
+	args = parser.parse_args()
+
+	# Options for parsing, as parse-geometric.py would give them
+	args.debug = False
+	args.epic = None
+	args.page = None
+	args.source_pdf = None
+	args.stats = False
+	args.stats_json = None
+	args.write_index = False
+	args.page_jobs = 1
+
+	items = []
+	for boothNo in range(args.minIdx, args.maxIdx+1):
+		url = args.url_format%(args.areaCode, args.areaCode, boothNo)
+		name = url.split('/')[-1].replace('.pdf', '')
+		items.append((url, name))
+
+	(stages, results, failed) = pipeline.runVoterLists(items, args.pdf_dir, args.xml_dir, args.output_dir, args,
+		downloadJobs=args.download_jobs, convertJobs=args.convert_jobs, parseJobs=args.parse_jobs,
+		interval=args.interval, retries=args.retries, command=args.pdftoxml, queueSize=args.queue_size)
+	pipeline.report(stages, results, failed)
+	if failed:
+		sys.exit(1)
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+"""
+Search voter records produced by parse-geometric.py.
+
+The first run builds an index from the given CSV files or SQLite
+databases (or directories containing them), and saves it. Later
+runs use the saved index, and rebuild it only if the sources have
+changed.
+
+e.g.
+  ./search-voters.py -e REJ5021886 csv/
+  ./search-voters.py -n "ramesh kumar" -r lakshmi csv/
+  ./search-voters.py -n "ramesh kumar" --age 40 --age-tolerance 2
+"""
+import sys
+import codecs
+import argparse
+
+import voterindex
+from geometric import sep
+
+parser = argparse.ArgumentParser()
+parser.add_argument("sources", type=str, nargs='*', help="CSV files or SQLite databases written by parse-geometric.py, or directories containing them. If none are given, the saved index is used as is.")
+parser.add_argument("--index", type=str, default='voterlist.idx', help="Index file, defaults to voterlist.idx")
+parser.add_argument("-e", "--epic", type=str, help="Find this EPIC number")
+parser.add_argument("-n", "--name", type=str, help="Find names similar to this")
+parser.add_argument("-r", "--relative", type=str, help="Find relative's names similar to this")
+parser.add_argument("--residence", type=str, help="Find residences similar to this")
+parser.add_argument("--relation", type=str, help="Only records with this relation (Father, Husband, Mother)")
+parser.add_argument("--age", type=int, help="Only records with this age")
+parser.add_argument("--age-tolerance", type=int, default=0, help="Allow the age to be off by this many years")
+parser.add_argument("--min-score", type=float, default=0.5, help="Minimum similarity (0 to 1) for fuzzy matches, defaults to 0.5")
+parser.add_argument("--limit", type=int, default=20, help="Show at most this many results, defaults to 20")
+args = parser.parse_args()
+
+index = voterindex.openIndex(args.index, voterindex.findSources(args.sources))
+
+if not (args.epic or args.name or args.relative or args.residence):
+	print >> sys.stderr, "Index has %d records. Give one of -e, -n, -r or --residence to search."%(index.count())
+	sys.exit(0)
+
+results = voterindex.search(index, epic=args.epic, name=args.name,
+	relative=args.relative, residence=args.residence,
+	relation=args.relation, age=args.age, ageTolerance=args.age_tolerance,
+	minScore=args.min_score, limit=args.limit)
+
+out = codecs.getwriter('utf-8')(sys.stdout)
+print >>out, sep.join(['score'] + voterindex.fields)
+for (score, rec) in results:
+	print >>out, sep.join(['%.2f'%(score)] + map(lambda v: u'%s'%(v), rec))
@@ -0,0 +1,40 @@
+#!/usr/bin/python
+"""
+Serve lookups of voter records over HTTP, from the output of
+parse-geometric.py (see voterserver.py for the queries).
+
+e.g.
+  ./serve-voters.py csv/
+  curl 'http://localhost:8000/epic?id=REJ5021886'
+  curl 'http://localhost:8000/name?prefix=ramesh&limit=10'
+  curl 'http://localhost:8000/booth?ac=154&booth=310'
+"""
+import argparse
+import time
+import sys
+
+import voterserver
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("sources", type=str, nargs='+', help="CSV files, csvz files or SQLite databases written by parse-geometric.py, or directories containing them")
+	parser.add_argument("--host", type=str, default='127.0.0.1', help="Address to listen on, defaults to 127.0.0.1 (this machine only)")
+	parser.add_argument("--port", type=int, default=8000, help="Port to listen on, defaults to 8000")
+	parser.add_argument("--cache-size", type=int, default=10000, help="Number of answers to keep in the cache, defaults to 10000")
+	parser.add_argument("--reload-interval", type=float, default=5.0, help="Seconds between checks for changes to the sources, defaults to 5")
+	parser.add_argument("--verbose", help="Log every request", action="store_true")
+	args = parser.parse_args()
+
+	start = time.time()
+	service = voterserver.VoterService(args.sources, args.cache_size)
+	(data, cache) = service.state
+	print 'Loaded %d records from %d files in %.1f secs.'%(len(data.records), len(data.sources), time.time() - start)
+	service.watch(args.reload_interval)
+
+	server = voterserver.Server((args.host, args.port), service, args.verbose)
+	print 'Serving on http://%s:%d/ (Ctrl-C to stop) ...'%(args.host, args.port)
+	sys.stdout.flush()
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
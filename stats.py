@@ -0,0 +1,106 @@
+"""
+Timing and counters for the stages of processing.
+
+Stats collects the wall time spent in each stage, and counters of
+things seen (pages, rects, tokens, records ...). NullStats has the
+same interface, but does nothing; it is used when stats are not
+asked for, so that the instrumentation costs next to nothing.
+
+Stats from several files (e.g. the files of a batch, processed in
+different worker processes) are combined with merge().
+"""
+import time
+
+# Stages, in the order they are reported
+stageOrder = ['parse', 'shapes', 'findRects', 'assign', 'extract', 'write']
+
+class Timer(object):
+	def __init__(self, stats, stage):
+		self.stats = stats
+		self.stage = stage
+
+	def __enter__(self):
+		self.start = time.time()
+		return self
+
+	def __exit__(self, excType, excValue, tb):
+		self.stats.addTime(self.stage, time.time() - self.start)
+		return False
+
+class NullTimer(object):
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, tb):
+		return False
+
+nullTimer = NullTimer()
+
+class NullStats(object):
+	enabled = False
+
+	def timer(self, stage):
+		return nullTimer
+
+	def clock(self):
+		return 0
+
+	def addTime(self, stage, seconds):
+		pass
+
+	def addSince(self, stage, start):
+		pass
+
+	def count(self, name, n=1):
+		pass
+
+class Stats(object):
+	enabled = True
+
+	def __init__(self, times=None, counts=None):
+		self.times = dict(times or {})
+		self.counts = dict(counts or {})
+
+	def timer(self, stage):
+		# For use in a 'with' statement, around the code of a stage
+		return Timer(self, stage)
+
+	def clock(self):
+		return time.time()
+
+	def addTime(self, stage, seconds):
+		self.times[stage] = self.times.get(stage, 0.0) + seconds
+
+	def addSince(self, stage, start):
+		# Add the time since 'start' (from clock()) to the stage
+		self.addTime(stage, time.time() - start)
+
+	def count(self, name, n=1):
+		self.counts[name] = self.counts.get(name, 0) + n
+
+	def merge(self, other):
+		for (stage, seconds) in other.times.items():
+			self.addTime(stage, seconds)
+		for (name, n) in other.counts.items():
+			self.count(name, n)
+
+	def toDict(self):
+		return {'times' : self.times, 'counts' : self.counts}
+
+def fromDict(d):
+	return Stats(d['times'], d['counts'])
+
+def report(s, f):
+	# Print the stats as a table
+	total = sum(s.times.values())
+	stages = filter(lambda st: st in s.times, stageOrder) + sorted(filter(lambda st: st not in stageOrder, s.times.keys()))
+	print >>f, '  %-16s %10s %6s'%('stage', 'seconds', '%')
+	for stage in stages:
+		pct = 0.0
+		if total > 0:
+			pct = 100.0*s.times[stage]/total
+		print >>f, '  %-16s %10.3f %6.1f'%(stage, s.times[stage], pct)
+	print >>f, '  %-16s %10.3f'%('total', total)
+	print >>f, '  %-16s %10s'%('counter', 'value')
+	for name in sorted(s.counts.keys()):
+		print >>f, '  %-16s %10d'%(name, s.counts[name])
@@ -0,0 +1,194 @@
+"""
+Generates synthetic voter lists, in the format written by pdftoxml.
+
+Real electoral rolls can't be shared, so this is used for benchmarks,
+and for trying out changes to the parser. The generated document has
+the same structure as pdftoxml output:
+
+  - <name>.xml with a PAGE per page. Each PAGE holds the TOKENs of
+    the page, and ends with a xi:include of the vector file for
+    the page.
+  - <name>.xml_data/image-<n>.vec vector files, with a GROUP per
+    shape. Voter boxes are drawn either as one 5 point GROUP, or as
+    four separate 2 point GROUPs (lines).
+
+Every page has a grid of voter boxes, with header text and some
+decorative shapes around it. Coordinates can be jittered, and some
+records drawn without EPIC numbers, to look like real rolls.
+"""
+import random
+import os
+
+firstNames = ['Ramesh', 'Suresh', 'Sita', 'Geeta', 'Lakshmi', 'Anil', 'Sunil',
+	'Mohan', 'Kiran', 'Ravi', 'Rajesh', 'Manjunath', 'Shivanna', 'Nagaraj',
+	'Kavitha', 'Pushpa', 'Savitha', 'Venkatesh', 'Srinivas', 'Prakash']
+lastNames = ['Kumar', 'Rao', 'Gowda', 'Reddy', 'Shetty', 'Naik', 'Murthy',
+	'Swamy', 'Devi', 'N', 'K', 'B', 'S']
+streets = ['Main Road', 'Cross Road', '1st Stage', 'BEML Layout', 'Kenchenahalli',
+	'Halagevaderahalli', 'Rajarajeshwarinagar']
+
+# Settings for a generated roll. Dimensions are in points, and
+# match the boxes of real rolls (see config.py)
+defaults = {
+	'pages' : 10,
+	'rows' : 10,
+	'cols' : 3,
+	'boxWidth' : 180.0,
+	'boxHeight' : 70.0,
+	'left' : 20.0,
+	'top' : 60.0,
+	'gap' : 5.0,
+	# Fraction of boxes drawn as separate lines, rather than
+	# as a rectangle
+	'lineRatio' : 0.5,
+	# Decorative shapes per page
+	'noise' : 20,
+	# Random displacement of coordinates
+	'jitter' : 0.2,
+	# Fraction of records without an EPIC number
+	'missingEpic' : 0.05,
+	'seed' : 1,
+}
+
+def escape(text):
+	return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+class Writer(object):
+	# Writes out TOKENs and GROUPs with running ids, as pdftoxml does
+	def __init__(self, xmlFile, vecFile, pageNo):
+		self.xml = xmlFile
+		self.vec = vecFile
+		self.pageNo = pageNo
+		self.tokenId = 0
+		self.groupId = 0
+
+	def token(self, x, y, text, size=8.0):
+		self.tokenId = self.tokenId + 1
+		self.xml.write('<TOKEN sid="p%d_s%d" id="p%d_w%d" font-name="arial" symbolic="no" serif="no" fixed-width="no" bold="no" italic="no" font-size="%.1f" font-color="#000000" rotation="0" angle="0" x="%.3f" y="%.3f" base="%.3f" width="%.3f" height="%.3f">%s</TOKEN>\n'%(
+			self.pageNo, self.tokenId, self.pageNo, self.tokenId, size, x, y, y+size, len(text)*size*0.5, size, escape(text)))
+
+	def group(self, points):
+		self.groupId = self.groupId + 1
+		self.vec.write('<GROUP sid="p%d_s%d" closed="false" style="fill:none;stroke:#000000;stroke-width:0.5">'%(self.pageNo, self.groupId))
+		(x, y) = points[0]
+		self.vec.write('<M x="%.3f" y="%.3f"/>'%(x, y))
+		for (x, y) in points[1:]:
+			self.vec.write('<L x="%.3f" y="%.3f"/>'%(x, y))
+		self.vec.write('</GROUP>\n')
+
+def boxTokens(rnd, x, y, serial, s):
+	# Returns the (x, y, text) for the tokens of one voter box, in
+	# the order pdftoxml tends to give them
+	toks = []
+	def words(tx, ty, text):
+		for w in text.split():
+			toks.append((tx, ty + rnd.uniform(-0.8, 0.8), w))
+			tx = tx + len(w)*4.0 + 3.0
+
+	if rnd.random() < 0.02:
+		# Some serials have a prefix, e.g. "(S) 12"
+		words(x+2, y+3, '(S) %d'%(serial))
+	else:
+		words(x+2, y+3, '%d'%(serial))
+	if rnd.random() >= s['missingEpic']:
+		words(x+60, y+3, '%s%07d'%(rnd.choice(['REJ', 'KA1', 'MHZ']), rnd.randint(0, 9999999)))
+	words(x+2, y+15, "Elector's Name :")
+	words(x+70, y+15, '%s %s'%(rnd.choice(firstNames), rnd.choice(lastNames)))
+	words(x+2, y+27, "%s's Name :"%(rnd.choice(['Father', 'Husband', 'Mother'])))
+	words(x+70, y+27, '%s %s'%(rnd.choice(firstNames), rnd.choice(lastNames)))
+	words(x+2, y+39, 'House No. :')
+	words(x+70, y+39, '%d/%d, %s'%(rnd.randint(1, 999), rnd.randint(1, 20), rnd.choice(streets)))
+	words(x+2, y+51, 'Age : %d'%(rnd.randint(18, 99)))
+	words(x+70, y+51, 'Sex : %s'%(rnd.choice(['Male', 'Female'])))
+	words(x+140, y+20, 'Photo')
+	words(x+140, y+30, 'Not')
+	words(x+140, y+40, 'Available')
+	return toks
+
+def generate(filename, settings={}):
+	# Write a synthetic roll to filename (and its _data directory).
+	# Returns the number of voter boxes in it.
+	s = dict(defaults)
+	s.update(settings)
+	rnd = random.Random(s['seed'])
+	def j(v):
+		return v + rnd.uniform(-s['jitter'], s['jitter'])
+
+	dataDir = filename + '_data'
+	if not os.path.isdir(dataDir):
+		os.makedirs(dataDir)
+	dataName = os.path.basename(dataDir)
+
+	f = open(filename, 'w')
+	f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+	f.write('<DOCUMENT>\n<METADATA>\n<PDFFILENAME>%s</PDFFILENAME>\n<PROCESS name="synthetic"/>\n</METADATA>\n'%(escape(os.path.basename(filename))))
+	serial = 0
+	for pageNo in range(1, s['pages']+1):
+		vecName = 'image-%d.vec'%(pageNo)
+		vec = open(os.path.join(dataDir, vecName), 'w')
+		vec.write('<?xml version="1.0" encoding="UTF-8"?>\n<VECTORIALIMAGES>\n')
+		f.write('<PAGE width="595.000" height="842.000" number="%d" id="p%d">\n'%(pageNo, pageNo))
+		f.write('<MEDIABOX x1="0" y1="0" x2="595" y2="842"/>\n')
+		w = Writer(f, vec, pageNo)
+
+		# Page header, and its decorations
+		f.write('<BLOCK id="p%d_b0">\n<TEXT id="p%d_t0" x="20" y="20" width="400" height="10">\n'%(pageNo, pageNo))
+		for (i, word) in enumerate(['Electoral', 'Roll', '2014', 'Assembly', 'Constituency', 'Part', 'No.', str(pageNo)]):
+			w.token(20 + i*50, 20, word, 10.0)
+		f.write('</TEXT>\n</BLOCK>\n')
+		w.group([(10, 10), (585, 10), (585, 832), (10, 832), (10, 10)])
+		w.group([(20, 45), (575, 45)])
+
+		for row in range(s['rows']):
+			for col in range(s['cols']):
+				serial = serial + 1
+				x = s['left'] + col*(s['boxWidth'] + s['gap'])
+				y = s['top'] + row*(s['boxHeight'] + s['gap'])
+				x2 = x + s['boxWidth']
+				y2 = y + s['boxHeight']
+				if rnd.random() < s['lineRatio']:
+					# Lines in arbitrary order and direction. Corners
+					# are shared, so they have the same coordinates.
+					corners = [(j(x), j(y)), (j(x2), j(y)), (j(x2), j(y2)), (j(x), j(y2))]
+					lines = [(corners[0], corners[1]), (corners[1], corners[2]),
+						(corners[3], corners[2]), (corners[0], corners[3])]
+					rnd.shuffle(lines)
+					for (a, b) in lines:
+						# pdftoxml lines are exactly horizontal or vertical
+						if a[0] != b[0] and a[1] != b[1]:
+							if abs(a[0]-b[0]) < abs(a[1]-b[1]):
+								b = (a[0], b[1])
+							else:
+								b = (b[0], a[1])
+						if rnd.random() < 0.5:
+							(a, b) = (b, a)
+						w.group([a, b])
+				else:
+					x1 = j(x)
+					y1 = j(y)
+					w.group([(x1, y1), (x2, y1), (x2, y2), (x1, y2), (x1, y1)])
+
+				# Photo frame and underline, inside the box
+				w.group([(x2-45, y+5), (x2-5, y+5), (x2-5, y+50), (x2-45, y+50), (x2-45, y+5)])
+				w.group([(x+2, y+12), (x+50, y+12)])
+
+				toks = boxTokens(rnd, x, y, serial, s)
+				f.write('<BLOCK id="p%d_b%d">\n<TEXT id="p%d_t%d" x="%.3f" y="%.3f" width="%.3f" height="%.3f">\n'%(
+					pageNo, serial, pageNo, serial, x, y, s['boxWidth'], s['boxHeight']))
+				for (tx, ty, text) in toks:
+					w.token(j(tx), ty, text)
+				f.write('</TEXT>\n</BLOCK>\n')
+
+		# Decorative shapes: polylines and short strokes
+		for i in range(s['noise']):
+			npts = rnd.choice([2, 3, 4, 6, 8])
+			cx = rnd.uniform(20, 575)
+			cy = rnd.uniform(20, 820)
+			w.group(map(lambda k: (cx + rnd.uniform(-15, 15), cy + rnd.uniform(-15, 15)), range(npts)))
+
+		vec.write('</VECTORIALIMAGES>\n')
+		vec.close()
+		f.write('<xi:include xmlns:xi="http://www.w3.org/2001/XInclude" href="%s/%s"/>\n</PAGE>\n'%(dataName, vecName))
+	f.write('</DOCUMENT>\n')
+	f.close()
+	return serial
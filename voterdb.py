@@ -0,0 +1,57 @@
+"""
+SQLite storage for voter records.
+
+All records go into a single 'voters' table, with columns that
+identify the source (file, AC, booth, page and serial) followed by
+the fields of the record. Lookups by EPIC, name and relative's name
+are indexed.
+
+Loading the same file again replaces its records, rather than
+adding duplicates.
+"""
+import sqlite3
+
+fields = ['file', 'ac', 'booth', 'page', 'serial', 'epic', 'name', 'age',
+          'sex', 'relation', 'relative', 'residence']
+
+schema = [
+	'''CREATE TABLE IF NOT EXISTS voters (
+		file TEXT NOT NULL,
+		ac TEXT,
+		booth TEXT,
+		page INTEGER NOT NULL,
+		serial TEXT NOT NULL,
+		epic TEXT,
+		name TEXT,
+		age TEXT,
+		sex TEXT,
+		relation TEXT,
+		relative TEXT,
+		residence TEXT)''',
+	'CREATE UNIQUE INDEX IF NOT EXISTS voters_source ON voters(file, page, serial)',
+	'CREATE INDEX IF NOT EXISTS voters_epic ON voters(epic)',
+	'CREATE INDEX IF NOT EXISTS voters_name ON voters(name)',
+	'CREATE INDEX IF NOT EXISTS voters_relative ON voters(relative)',
+]
+
+def connect(path):
+	# Open the database, creating the table and indexes if needed.
+	conn = sqlite3.connect(path)
+	# Each file is loaded in one transaction, so it's safe to
+	# relax syncing within it.
+	conn.execute('PRAGMA synchronous=NORMAL')
+	for stmt in schema:
+		conn.execute(stmt)
+	conn.commit()
+	return conn
+
+def deleteFile(conn, name):
+	# Remove all records for the given file (name without extension)
+	conn.execute('DELETE FROM voters WHERE file=?', (name,))
+
+def insertRecords(conn, records):
+	# Insert records (dicts with all of 'fields'). A record that
+	# already exists for the same file, page and serial is replaced.
+	stmt = 'INSERT OR REPLACE INTO voters (%s) VALUES (%s)'%(
+		', '.join(fields), ', '.join(['?']*len(fields)))
+	conn.executemany(stmt, map(lambda info: tuple(map(lambda k: info[k], fields)), records))
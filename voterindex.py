@@ -0,0 +1,329 @@
+"""
+Search index over parsed voter records.
+
+Records are loaded from the output of parse-geometric.py: CSV files
+(per file, or merged), block compressed files (csvz) and SQLite
+databases. The index has
+
+  - an exact lookup on EPIC number
+  - a character trigram index on name, relative's name and residence,
+    for matching names that are misspelt, or split differently
+    across words.
+
+Fuzzy matches are ranked by the Dice coefficient of the trigrams of
+the query and the field: 2*common/(query grams + field grams).
+
+The index is saved to a SQLite database, and is rebuilt only when one
+of the source files has changed.
+"""
+import cPickle
+import codecs
+import sqlite3
+import array
+import math
+import re
+import os
+
+import voterdb
+import blockfile
+from geometric import rollInfo, sep
+
+# Bump this when the layout of the index changes
+indexVersion = 1
+
+fields = voterdb.fields
+
+# Fields that have a trigram index
+fuzzyFields = ['name', 'relative', 'residence']
+
+reNonAlnum = re.compile('[^0-9a-z]+')
+
+def normalize(text):
+	return reNonAlnum.sub(' ', text.lower()).strip()
+
+def trigrams(text):
+	# Set of character trigrams in the text. Leading padding gives
+	# weight to the start of the text, which tends to be spelt right.
+	text = normalize(text)
+	if not text:
+		return set()
+	text = '  ' + text + ' '
+	return set(map(lambda i: text[i:i+3], range(len(text)-2)))
+
+#
+# Loading records
+#
+
+def findSources(paths):
+	# Directories are expanded to the CSV files and databases in them
+	sources = []
+	for path in paths:
+		if os.path.isdir(path):
+			for name in sorted(os.listdir(path)):
+				if os.path.splitext(name)[1] in ['.csv', '.csvz', '.db']:
+					sources.append(os.path.join(path, name))
+		else:
+			sources.append(path)
+	return sources
+
+def readCsv(path):
+	# Yields records from a CSV written by parse-geometric.py. Files
+	# that are not merged have no file/ac/booth columns; these are
+	# taken from the name of the CSV file.
+	f = codecs.open(path, 'r', 'utf-8')
+	try:
+		header = f.readline().rstrip('\r\n').split(sep)
+		(name, ac, booth) = rollInfo(path.replace('.csv', '.xml'))
+		for line in f:
+			values = line.rstrip('\r\n').split(sep)
+			if len(values) > len(header):
+				# The separator appeared in the last field (residence)
+				values = values[:len(header)-1] + [sep.join(values[len(header)-1:])]
+			info = dict(zip(header, values))
+			if 'file' not in info:
+				info['file'] = name
+				info['ac'] = ac
+				info['booth'] = booth
+			yield tuple(map(lambda k: info.get(k, ''), fields))
+	finally:
+		f.close()
+
+def readDb(path):
+	conn = sqlite3.connect(path)
+	try:
+		for row in conn.execute('SELECT %s FROM voters ORDER BY file, page'%(', '.join(fields))):
+			yield tuple(map(lambda v: '%s'%(v) if v is not None else '', row))
+	finally:
+		conn.close()
+
+def readBlocks(path):
+	# Yields records from a block compressed file, which has the same
+	# fields as the CSV output
+	reader = blockfile.BlockReader(path)
+	try:
+		(name, ac, booth) = rollInfo(path.replace('.csvz', '.xml'))
+		for values in reader.records():
+			info = dict(zip(reader.fields, values))
+			if 'file' not in info:
+				info['file'] = name
+				info['ac'] = ac
+				info['booth'] = booth
+			yield tuple(map(lambda k: info.get(k, ''), fields))
+	finally:
+		reader.close()
+
+def readSource(path):
+	if path.endswith('.db'):
+		return readDb(path)
+	if path.endswith('.csvz'):
+		return readBlocks(path)
+	return readCsv(path)
+
+def sourceStamp(sources):
+	return map(lambda p: (os.path.abspath(p), os.path.getsize(p), os.path.getmtime(p)), sources)
+
+#
+# Building and using the index
+#
+# The index is kept in a SQLite database:
+#   records : the records, with an index on EPIC
+#   grams   : for each (field, trigram), the ids of records that have
+#             the trigram in the field, as a packed array
+#   info    : version, source files, and the number of trigrams in each
+#             record's fields (packed arrays), used for scoring.
+#
+# Only the trigram counts are read up front. Posting lists are read
+# for the trigrams in a query, and records for the top results.
+#
+
+schema = [
+	'CREATE TABLE info (key TEXT PRIMARY KEY, value BLOB)',
+	'CREATE TABLE records (rid INTEGER PRIMARY KEY, %s)'%(', '.join(fields)),
+	'CREATE TABLE grams (field TEXT, gram TEXT, rids BLOB, PRIMARY KEY (field, gram))',
+]
+
+def buildIndex(sources, path):
+	tmpPath = path + '.tmp'
+	if os.path.exists(tmpPath):
+		os.remove(tmpPath)
+	conn = sqlite3.connect(tmpPath)
+	conn.text_factory = str
+	conn.execute('PRAGMA synchronous=OFF')
+	for stmt in schema:
+		conn.execute(stmt)
+
+	grams = {}
+	gramCounts = {}
+	for field in fuzzyFields:
+		grams[field] = {}
+		gramCounts[field] = array.array('H')
+	fieldPos = dict(map(lambda i: (fields[i], i), range(len(fields))))
+	insert = 'INSERT INTO records VALUES (?, %s)'%(', '.join(['?']*len(fields)))
+
+	rid = 0
+	batch = []
+	for source in sources:
+		for rec in readSource(source):
+			batch.append((rid,) + rec)
+			for field in fuzzyFields:
+				tg = trigrams(rec[fieldPos[field]])
+				gramCounts[field].append(min(len(tg), 65535))
+				postings = grams[field]
+				for g in tg:
+					p = postings.get(g)
+					if p is None:
+						p = postings[g] = array.array('i')
+					p.append(rid)
+			rid = rid + 1
+			if len(batch) >= 10000:
+				conn.executemany(insert, batch)
+				batch = []
+	conn.executemany(insert, batch)
+
+	for field in fuzzyFields:
+		conn.executemany('INSERT INTO grams VALUES (?, ?, ?)',
+			map(lambda (g, p): (field, g, buffer(p.tostring())), grams[field].iteritems()))
+		conn.execute('INSERT INTO info VALUES (?, ?)', ('count:' + field, buffer(gramCounts[field].tostring())))
+	conn.execute('INSERT INTO info VALUES (?, ?)', ('version', indexVersion))
+	conn.execute('INSERT INTO info VALUES (?, ?)', ('sources', buffer(cPickle.dumps(sourceStamp(sources), 2))))
+	conn.execute('CREATE INDEX records_epic ON records(epic)')
+	conn.commit()
+	conn.close()
+
+	# Replace the old index only once the new one is complete
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(tmpPath, path)
+
+class VoterIndex(object):
+	def __init__(self, path):
+		self.conn = sqlite3.connect(path)
+		self.info = dict(self.conn.execute('SELECT key, value FROM info'))
+		self.gramCounts = {}
+		for field in fuzzyFields:
+			counts = array.array('H')
+			counts.fromstring(str(self.info['count:' + field]))
+			self.gramCounts[field] = counts
+
+	def isCurrent(self, sources):
+		if self.info.get('version') != indexVersion:
+			return False
+		return cPickle.loads(str(self.info['sources'])) == sourceStamp(sources)
+
+	def count(self):
+		return len(self.gramCounts[fuzzyFields[0]])
+
+	def close(self):
+		self.conn.close()
+
+	def lookupEpic(self, epic):
+		return map(lambda row: row[0], self.conn.execute('SELECT rid FROM records WHERE epic=?', (epic.strip().upper(),)))
+
+	def postings(self, field, gram):
+		row = self.conn.execute('SELECT rids FROM grams WHERE field=? AND gram=?', (field, gram)).fetchone()
+		rids = array.array('i')
+		if row is not None:
+			rids.fromstring(str(row[0]))
+		return rids
+
+	def records(self, rids):
+		# Returns {rid : record} for the given ids
+		found = {}
+		rids = list(rids)
+		for i in range(0, len(rids), 500):
+			chunk = rids[i:i+500]
+			stmt = 'SELECT rid, %s FROM records WHERE rid IN (%s)'%(', '.join(fields), ', '.join(['?']*len(chunk)))
+			for row in self.conn.execute(stmt, chunk):
+				found[row[0]] = tuple(map(lambda v: v if v is not None else '', row[1:]))
+		return found
+
+	def fuzzyScores(self, field, query, minScore):
+		# Returns {record id : score} for records whose field is similar
+		# to query, with a score of at least minScore.
+		qgrams = trigrams(query)
+		if not qgrams:
+			return {}
+		counts = self.gramCounts[field]
+		common = {}
+		for g in qgrams:
+			for rid in self.postings(field, g):
+				common[rid] = common.get(rid, 0) + 1
+		qn = len(qgrams)
+		# A record can only reach minScore if it shares enough grams
+		minCommon = int(math.ceil(minScore*qn/(2.0-minScore)))
+		scores = {}
+		for (rid, c) in common.iteritems():
+			if c < minCommon:
+				continue
+			score = 2.0*c/(qn + counts[rid])
+			if score >= minScore:
+				scores[rid] = score
+		return scores
+
+def openIndex(path, sources):
+	# Open the index at path, if it is up to date with respect to
+	# the sources. Otherwise (re)build it first. With no sources,
+	# the existing index is used as it is.
+	if os.path.isfile(path):
+		try:
+			index = VoterIndex(path)
+			if (not sources) or index.isCurrent(sources):
+				return index
+			index.close()
+		except sqlite3.DatabaseError:
+			# Not an index, or a damaged one
+			if not sources:
+				raise
+	if not sources:
+		raise IOError('No index at %s, and no sources to build it from'%(path))
+	buildIndex(sources, path)
+	return VoterIndex(path)
+
+def search(index, epic=None, name=None, relative=None, residence=None,
+	relation=None, age=None, ageTolerance=0, minScore=0.5, limit=20):
+	# Returns a ranked list of (score, record). All given criteria
+	# must match. The score is the average score over the fuzzy
+	# criteria, and 1.0 for exact criteria.
+	fieldPos = dict(map(lambda i: (fields[i], i), range(len(fields))))
+	candidates = None
+	if epic:
+		candidates = dict(map(lambda rid: (rid, [1.0]), index.lookupEpic(epic)))
+	for (field, query) in [('name', name), ('relative', relative), ('residence', residence)]:
+		if not query:
+			continue
+		scores = index.fuzzyScores(field, query, minScore)
+		if candidates is None:
+			candidates = dict(map(lambda (rid, s): (rid, [s]), scores.iteritems()))
+		else:
+			for rid in candidates.keys():
+				if rid in scores:
+					candidates[rid].append(scores[rid])
+				else:
+					del candidates[rid]
+	if candidates is None:
+		return []
+
+	# Best score first, then in the order of the source
+	ranked = map(lambda (rid, scores): (sum(scores)/len(scores), rid), candidates.iteritems())
+	ranked.sort(key=lambda (score, rid): (-score, rid))
+
+	# Records are read in chunks, in rank order, till there are
+	# enough that pass the filters.
+	results = []
+	for i in range(0, len(ranked), 500):
+		chunk = ranked[i:i+500]
+		records = index.records(map(lambda (score, rid): rid, chunk))
+		for (score, rid) in chunk:
+			rec = records[rid]
+			if relation and rec[fieldPos['relation']].lower() != relation.lower():
+				continue
+			if age is not None:
+				try:
+					if abs(int(rec[fieldPos['age']]) - age) > ageTolerance:
+						continue
+				except ValueError:
+					continue
+			results.append((score, rec))
+			if len(results) >= limit:
+				return results
+	return results
@@ -0,0 +1,308 @@
+"""
+HTTP lookup service over parsed voter records (serve-voters.py).
+
+Records are loaded from the output of parse-geometric.py (CSV files,
+block compressed files, SQLite databases, or directories of these) into
+memory, with
+
+  - a table of EPIC numbers
+  - the names, normalized as by voterindex.normalize, in sorted
+    order, for prefix lookups by bisection
+  - a table of booths, by AC and booth number, and by source file
+
+Queries (GET, answered with JSON):
+
+  /epic?id=REJ5021886
+  /name?prefix=ramesh k&limit=50
+  /booth?ac=154&booth=310   or   /booth?file=AC1540310
+  /status
+
+Answers have the records that matched, with
+
+  count : the number of records in the answer
+  total : the number of records that matched
+
+Name and booth answers have at most limit= records (50 for names, and
+never more than maxLimit); use offset= for the rest. A query that is
+not valid (e.g. a missing parameter, or one that is not UTF-8) is
+answered with 400, and a failure of the server with 500, both with
+the error in the JSON.
+
+Answers are kept in an LRU cache, keyed by the query. The sources are
+checked every few seconds, and loaded again if any of them changed (or
+files were added to a directory). Queries are answered from the old
+records while the new ones load; the cache is emptied when they are
+swapped in.
+
+Requests are handled by a thread each, and connections are kept alive.
+"""
+import BaseHTTPServer
+import SocketServer
+import collections
+import threading
+import traceback
+import urlparse
+import socket
+import bisect
+import array
+import json
+import time
+import sys
+
+import voterindex
+from voterindex import normalize
+
+fields = voterindex.fields
+fieldPos = dict(map(lambda i: (fields[i], i), range(len(fields))))
+
+# Most records an answer can have, whatever the limit asked for. This
+# is more than the largest booths have.
+maxLimit = 2000
+
+class QueryError(Exception):
+	pass
+
+class LRUCache(object):
+	def __init__(self, size):
+		self.size = size
+		self.entries = collections.OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		self.lock.acquire()
+		try:
+			value = self.entries.pop(key, None)
+			if value is None:
+				self.misses = self.misses + 1
+				return None
+			# Most recently used entries are at the end
+			self.entries[key] = value
+			self.hits = self.hits + 1
+			return value
+		finally:
+			self.lock.release()
+
+	def put(self, key, value):
+		self.lock.acquire()
+		try:
+			self.entries.pop(key, None)
+			self.entries[key] = value
+			while len(self.entries) > self.size:
+				self.entries.popitem(last=False)
+		finally:
+			self.lock.release()
+
+def boothKey(ac, booth):
+	# AC and booth numbers with or without leading zeros
+	return (ac.lstrip('0'), booth.lstrip('0'))
+
+class VoterData(object):
+	# The records of the sources, and the indexes over them
+	def __init__(self, sources):
+		self.sources = sources
+		self.records = []
+		self.epics = {}
+		self.booths = {}
+		self.files = {}
+		names = []
+		for source in sources:
+			for rec in voterindex.readSource(source):
+				rid = len(self.records)
+				self.records.append(rec)
+				epic = rec[fieldPos['epic']]
+				if epic:
+					self.epics.setdefault(epic, []).append(rid)
+				key = boothKey(rec[fieldPos['ac']], rec[fieldPos['booth']])
+				self.booths.setdefault(key, array.array('i')).append(rid)
+				self.files.setdefault(rec[fieldPos['file']], array.array('i')).append(rid)
+				name = normalize(rec[fieldPos['name']])
+				if name:
+					names.append((name, rid))
+		names.sort()
+		self.nameKeys = map(lambda n: n[0], names)
+		self.nameIds = array.array('i', map(lambda n: n[1], names))
+		self.loaded = time.time()
+
+	def epic(self, epic):
+		return self.epics.get(epic, [])
+
+	def namePrefix(self, prefix):
+		prefix = normalize(prefix)
+		if not prefix:
+			raise QueryError('prefix has no letters or digits')
+		# Names starting with the prefix sort between the prefix and
+		# the prefix with its last character incremented
+		end = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+		return self.nameIds[bisect.bisect_left(self.nameKeys, prefix):bisect.bisect_left(self.nameKeys, end)]
+
+	def booth(self, ac, booth):
+		return self.booths.get(boothKey(ac, booth), [])
+
+	def file(self, name):
+		return self.files.get(name, [])
+
+def param(query, name, default=None):
+	values = query.get(name)
+	if not values:
+		if default is None:
+			raise QueryError('missing parameter: %s'%(name))
+		return default
+	try:
+		return values[0].decode('utf-8')
+	except UnicodeDecodeError:
+		raise QueryError('%s is not UTF-8'%(name))
+
+def intParam(query, name, default, limit=maxLimit):
+	try:
+		value = int(param(query, name, '%d'%(default)))
+	except ValueError:
+		raise QueryError('%s must be a number'%(name))
+	if value < 0:
+		raise QueryError('%s must not be negative'%(name))
+	if limit is not None:
+		return min(value, limit)
+	return value
+
+class VoterService(object):
+	# The current records, with their cache, and the reloading of
+	# the records when the sources change
+	def __init__(self, paths, cacheSize, log=sys.stderr):
+		self.paths = paths
+		self.cacheSize = cacheSize
+		self.log = log
+		self.reloads = 0
+		sources = voterindex.findSources(paths)
+		self.stamp = voterindex.sourceStamp(sources)
+		# (data, cache) are swapped together, so that a request sees
+		# one or the other, never a mix
+		self.state = (VoterData(sources), LRUCache(cacheSize))
+
+	def reloadIfChanged(self):
+		sources = voterindex.findSources(self.paths)
+		try:
+			stamp = voterindex.sourceStamp(sources)
+			if stamp == self.stamp:
+				return False
+			start = time.time()
+			data = VoterData(sources)
+		except Exception:
+			# e.g. a file was removed while loading. Keep what we
+			# have, and try again next time.
+			print >>self.log, 'Reload failed: %s'%(traceback.format_exc().strip().split('\n')[-1])
+			return False
+		self.state = (data, LRUCache(self.cacheSize))
+		self.stamp = stamp
+		self.reloads = self.reloads + 1
+		print >>self.log, 'Reloaded %d records from %d files in %.1f secs.'%(len(data.records), len(sources), time.time() - start)
+		return True
+
+	def watch(self, interval):
+		# Checks the sources every 'interval' seconds, in a thread
+		def check():
+			while True:
+				time.sleep(interval)
+				self.reloadIfChanged()
+		t = threading.Thread(target=check, name='reload')
+		t.daemon = True
+		t.start()
+
+	def answer(self, data, path, query):
+		# Returns the answer to a query (as a dict), or None if there is
+		# no such query
+		limit = maxLimit
+		if path == '/epic':
+			rids = data.epic(param(query, 'id'))
+		elif path == '/name':
+			rids = data.namePrefix(param(query, 'prefix'))
+			limit = 50
+		elif path == '/booth':
+			if 'file' in query:
+				rids = data.file(param(query, 'file'))
+			else:
+				rids = data.booth(param(query, 'ac'), param(query, 'booth'))
+		else:
+			return None
+		total = len(rids)
+		offset = intParam(query, 'offset', 0, None)
+		rids = rids[offset:offset+intParam(query, 'limit', limit)]
+		records = map(lambda rid: dict(zip(fields, data.records[rid])), rids)
+		return {'count' : len(records), 'total' : total, 'records' : records}
+
+	def status(self):
+		(data, cache) = self.state
+		return {
+			'records' : len(data.records),
+			'sources' : data.sources,
+			'loaded' : data.loaded,
+			'reloads' : self.reloads,
+			'cacheEntries' : len(cache.entries),
+			'cacheHits' : cache.hits,
+			'cacheMisses' : cache.misses,
+		}
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	# Keep connections alive, so that clients don't connect for
+	# every query
+	protocol_version = 'HTTP/1.1'
+	# Send the headers and body of a reply together. Written apart,
+	# the body waits for the client to acknowledge the headers, which
+	# it delays (by 40ms on Linux).
+	wbufsize = -1
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		try:
+			(code, body) = self.answer()
+		except Exception:
+			# Still answer, rather than leave the client waiting
+			print >>self.server.service.log, 'Error answering %s:\n%s'%(self.path, traceback.format_exc().strip())
+			(code, body) = (500, json.dumps({'error' : 'internal error'}))
+		self.reply(code, body)
+
+	def answer(self):
+		# Returns (status code, body) for the request
+		service = self.server.service
+		url = urlparse.urlparse(self.path)
+		if url.path == '/status':
+			return (200, json.dumps(service.status()))
+		(data, cache) = service.state
+		body = cache.get(self.path)
+		if body is None:
+			try:
+				answer = service.answer(data, url.path, urlparse.parse_qs(url.query))
+			except QueryError as e:
+				return (400, json.dumps({'error' : str(e)}))
+			if answer is None:
+				return (404, json.dumps({'error' : 'no such query: %s'%(url.path)}))
+			body = json.dumps(answer)
+			cache.put(self.path, body)
+		return (200, body)
+
+	def reply(self, code, body):
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', '%d'%(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address, service, verbose=False):
+		BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+		self.service = service
+		self.verbose = verbose
+
+	def handle_error(self, request, clientAddress):
+		# A client that goes away before the reply is sent is not an
+		# error of ours
+		if isinstance(sys.exc_info()[1], socket.error):
+			return
+		SocketServer.TCPServer.handle_error(self, request, clientAddress)
@@ -0,0 +1,216 @@
+"""
+Watches directories for XML files, and parses new and changed files as
+they appear (parse-geometric.py --watch).
+
+The files are parsed by a pool of worker processes that stays up for
+as long as the watch runs, so that Python, the modules and config.py
+are loaded once, not once per file. config.py is read when the workers
+start; restart the watch after changing it.
+
+The directories are polled. A file is taken up when its size and
+modification time are the same on two polls in a row, so that a file
+that pdftoxml is still writing is left alone. A file is parsed again
+if it changes later. On start, files whose output is newer than the
+file are not parsed again.
+
+The watch runs until it is interrupted (Ctrl-C) or killed. Files that
+are not finished then are left for the next run.
+
+Output is written to a temporary file next to the output, and renamed
+to the output when complete, so that readers never see a partial
+output.
+
+A status file (JSON) is rewritten as files are taken up and finished:
+
+  queued  : files given to the workers and not finished
+  waiting : files seen, but not yet unchanged over a poll
+  done, failed : counts since the start
+  files   : for each file, its state (queued, done or failed), the
+            output, the number of records, the error if it failed,
+            and its latency: seconds from being seen to the output
+            being ready. Only the last maxFiles files are kept, so
+            that the status of a long running watch does not grow
+            without end; files that are queued are always there.
+"""
+import multiprocessing
+import collections
+import signal
+import json
+import time
+import sys
+import os
+
+import geometric
+
+# Most files kept in the status file. Beyond this, the files that were
+# finished the longest time ago are dropped.
+maxFiles = 1000
+
+class Watcher(object):
+	def __init__(self, dirs, outputDir, opts, jobs, statusPath):
+		self.dirs = dirs
+		self.outputDir = outputDir
+		self.opts = opts
+		self.statusPath = statusPath
+		self.pool = multiprocessing.Pool(jobs, initializer=geometric.loadConfig)
+		# filename -> (size, mtime) when it was last given to the workers
+		self.taken = {}
+		# filename -> ((size, mtime), time first seen) for files
+		# waiting to be unchanged over a poll
+		self.waiting = {}
+		# filename -> (result, time first seen, output)
+		self.queued = {}
+		# filename -> status, in the order files were last submitted
+		# or finished
+		self.files = collections.OrderedDict()
+		self.done = 0
+		self.failed = 0
+		if not os.path.isdir(outputDir):
+			os.makedirs(outputDir)
+
+	def outputName(self, filename):
+		return geometric.batchOutputName(filename, self.outputDir, self.opts.format)
+
+	def isCurrent(self, filename):
+		# The output of an earlier run is newer than the file
+		output = self.outputName(filename)
+		return os.path.isfile(output) and os.path.getmtime(output) >= os.path.getmtime(filename)
+
+	def start(self):
+		for filename in geometric.findInputs(self.dirs):
+			if self.isCurrent(filename):
+				st = os.stat(filename)
+				self.taken[filename] = (st.st_size, st.st_mtime)
+
+	def poll(self):
+		# Takes up files that are new or changed, and unchanged since
+		# the last poll. Returns True if any file was taken up.
+		found = False
+		now = time.time()
+		present = set()
+		for filename in geometric.findInputs(self.dirs):
+			present.add(filename)
+			try:
+				st = os.stat(filename)
+			except OSError:
+				continue
+			stamp = (st.st_size, st.st_mtime)
+			if self.taken.get(filename) == stamp or filename in self.queued:
+				continue
+			seen = self.waiting.get(filename)
+			if seen is None or seen[0] != stamp:
+				self.waiting[filename] = (stamp, now if seen is None else seen[1])
+				continue
+			del self.waiting[filename]
+			self.submit(filename, stamp, seen[1])
+			found = True
+		# Forget files that were removed
+		for filename in self.taken.keys():
+			if filename not in present:
+				del self.taken[filename]
+		for filename in self.waiting.keys():
+			if filename not in present:
+				del self.waiting[filename]
+		return found
+
+	def submit(self, filename, stamp, seenAt):
+		output = self.outputName(filename)
+		tmpOutput = output + '.tmp'
+		if os.path.exists(tmpOutput):
+			os.remove(tmpOutput)
+		result = self.pool.apply_async(geometric.processBatchFile, ((filename, tmpOutput, self.opts),))
+		self.taken[filename] = stamp
+		self.queued[filename] = (result, seenAt, output)
+		self.files.pop(filename, None)
+		self.files[filename] = {'state' : 'queued', 'output' : output}
+
+	def collect(self):
+		# Finishes the files the workers are done with. Returns True if
+		# any were.
+		found = False
+		for filename in self.queued.keys():
+			(result, seenAt, output) = self.queued[filename]
+			if not result.ready():
+				continue
+			del self.queued[filename]
+			found = True
+			(filename, tmpOutput, count, records, cached, fileStats, error) = result.get()
+			info = self.files.pop(filename)
+			self.files[filename] = info
+			if error is not None:
+				self.failed = self.failed + 1
+				info['state'] = 'failed'
+				info['error'] = error.strip().split('\n')[-1]
+				print '%s => FAILED : %s'%(filename, info['error'])
+				sys.stdout.flush()
+				continue
+			if os.name == 'nt' and os.path.exists(output):
+				# rename does not replace a file on Windows
+				os.remove(output)
+			os.rename(tmpOutput, output)
+			self.done = self.done + 1
+			info['state'] = 'done'
+			info['records'] = count
+			info['latency'] = round(time.time() - seenAt, 3)
+			info.pop('error', None)
+			if cached:
+				print '%s => %s : %d records (cached).'%(filename, output, count)
+			else:
+				print '%s => %s : %d records.'%(filename, output, count)
+			sys.stdout.flush()
+		if found:
+			self.prune()
+		return found
+
+	def prune(self):
+		# Drops the files finished the longest time ago, beyond maxFiles
+		excess = len(self.files) - maxFiles
+		for filename in self.files.keys():
+			if excess <= 0:
+				break
+			if self.files[filename]['state'] != 'queued':
+				del self.files[filename]
+				excess = excess - 1
+
+	def writeStatus(self):
+		status = {
+			'updated' : time.time(),
+			'queued' : len(self.queued),
+			'waiting' : len(self.waiting),
+			'done' : self.done,
+			'failed' : self.failed,
+			'files' : self.files,
+		}
+		tmpPath = self.statusPath + '.tmp'
+		f = open(tmpPath, 'w')
+		try:
+			json.dump(status, f, indent=2, sort_keys=True)
+		finally:
+			f.close()
+		if os.name == 'nt' and os.path.exists(self.statusPath):
+			os.remove(self.statusPath)
+		os.rename(tmpPath, self.statusPath)
+
+	def run(self, interval):
+		# Stop cleanly (see below) when killed, as a daemon usually is
+		def stop(signum, frame):
+			raise SystemExit(0)
+		signal.signal(signal.SIGTERM, stop)
+
+		self.start()
+		self.writeStatus()
+		try:
+			while True:
+				changed = self.collect()
+				if changed:
+					geometric.evictCache(self.opts)
+				waiting = len(self.waiting)
+				if self.poll() or changed or len(self.waiting) != waiting:
+					self.writeStatus()
+				time.sleep(interval)
+		finally:
+			self.pool.terminate()
+			self.pool.join()
+			for (result, seenAt, output) in self.queued.values():
+				if os.path.exists(output + '.tmp'):
+					os.remove(output + '.tmp')